@@ -0,0 +1,379 @@
+#!/usr/bin/env python2
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+
+from kinematics import Kinematics
+from math_utils import *
+from graspit_pool import GraspitPool
+from graspit_scene import GraspitScene
+from plan_filter import ObjectDistance, PlanPrefilter, load_mesh
+from grasp_miner import GraspMiner
+from grasp_utils import *
+from shard_executor import ShardExecutor
+from sim_commander import DEFAULT_ROBOTS_DIR, SimulatedCommander, SimulatedProcess
+
+BENCHMARKS = [
+    'rotations', 'kinematics', 'conversion', 'scene', 'miner', 'speeds', 'variants', 'prefilter',
+    'startup', 'pool', 'shards'
+]
+
+parser = argparse.ArgumentParser(description='Client-side benchmarks with a simulated GraspIt')
+parser.add_argument('-b', '--benchmarks', nargs='*', choices=BENCHMARKS, default=BENCHMARKS)
+parser.add_argument('-n', '--n_grasps', type=int, default=2000, help="Grasps per benchmark")
+parser.add_argument('-o', '--n_objects', type=int, default=8, help="Objects per benchmark")
+parser.add_argument('-j',
+                    '--n_jobs',
+                    type=int,
+                    nargs='*',
+                    default=[1, 2, 4],
+                    help="Pool sizes and shard counts to benchmark")
+parser.add_argument('-s', '--max_steps', type=int, default=70000, help="Planner steps per object")
+parser.add_argument('-l',
+                    '--latency_scale',
+                    type=float,
+                    default=0.001,
+                    help="Simulated GraspIt latency multiplier")
+parser.add_argument('--robots_dir',
+                    type=str,
+                    default=DEFAULT_ROBOTS_DIR,
+                    help="Path to directory with robot models")
+
+
+def random_grasps(n, n_dofs=20, seed=0):
+    """Random hand root poses and joint angles
+
+    Arguments:
+        n {int} -- number of grasps
+
+    Keyword Arguments:
+        n_dofs {int} -- number of hand dofs (default: {20})
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        tuple -- (N,3) positions, (N,4) quaternions x,y,z,w, (N,n_dofs) angles
+    """
+    rs = np.random.RandomState(seed)
+    xyz = rs.uniform(-0.2, 0.2, size=(n, 3))
+    quat = rs.normal(size=(n, 4))
+    quat /= np.linalg.norm(quat, axis=1)[:, None]
+    dofs = rs.uniform(-0.2, 1.5, size=(n, n_dofs))
+    return xyz, quat, dofs
+
+
+def report(name, n, elapsed, unit='grasps'):
+    print('{:<40} {:>10.1f} {}/s'.format(name, n / elapsed, unit))
+
+
+def bench_rotations(args):
+    rs = np.random.RandomState(0)
+    n = args.n_grasps
+    quats = rs.normal(size=(n, 4))
+    quats /= np.linalg.norm(quats, axis=1)[:, None]
+    quats[:4] = [[0, 0, 0, 1], [0, 0, 0, -1], [1e-7, 0, 0, 1], [1, 0, 0, 0]]
+    rvecs = rs.uniform(-np.pi, np.pi, size=(n, 3))
+    rvecs[:2] = [[0, 0, 0], [np.pi, 0, 0]]
+    mats = mats_from_rvecs(rvecs)
+    angles = rs.uniform(-np.pi, np.pi, size=n)
+
+    pairs = [
+        ('mat_from_quat', mat_from_quat, mats_from_quats, quats),
+        ('mat_from_rvec', mat_from_rvec, mats_from_rvecs, rvecs),
+        ('rvec_from_quat', rvec_from_quat, rvecs_from_quats, quats),
+        ('rvec_from_mat', rvec_from_mat, rvecs_from_mats, mats),
+        ('quat_from_mat', quat_from_mat, quats_from_mats, mats),
+        ('mat_rotate_x', mat_rotate_x, mats_rotate_x, angles),
+        ('mat_rotate_y', mat_rotate_y, mats_rotate_y, angles),
+        ('mat_rotate_z', mat_rotate_z, mats_rotate_z, angles),
+    ]
+    for name, scalar, batch, inputs in pairs:
+        start = time.time()
+        expected = np.array([np.asarray(scalar(x)) for x in inputs])
+        scalar_time = time.time() - start
+        start = time.time()
+        result = batch(inputs)
+        batch_time = time.time() - start
+        error = np.abs(result - expected.reshape(result.shape)).max()
+        print('{:<40} {:>10.1f}x faster, max abs difference {:.1e}'.format(
+            name, scalar_time / batch_time, error))
+
+
+def bench_kinematics(args):
+    kinematics = Kinematics(os.path.join(args.robots_dir, 'ManoHand'))
+    xyz, quat, dofs = random_grasps(args.n_grasps)
+
+    start = time.time()
+    scalar = [kinematics.getManoPose(x, q, d) for x, q, d in zip(xyz, quat, dofs)]
+    report('Kinematics.getManoPose', len(xyz), time.time() - start)
+
+    start = time.time()
+    trans, pose = kinematics.getManoPoses(xyz, quat, dofs)
+    report('Kinematics.getManoPoses', len(xyz), time.time() - start)
+
+    error = max(
+        np.abs(trans - np.reshape([t for t, _ in scalar], trans.shape)).max(),
+        np.abs(pose - np.array([p for _, p in scalar])).max())
+    print('{:<40} {:>10.1e}'.format('max abs difference', error))
+
+
+def bench_conversion(args):
+    kinematics = Kinematics(os.path.join(args.robots_dir, 'ManoHand'))
+    graspit = SimulatedCommander(latency_scale=0)
+    graspit.importGraspableBody('body')
+    states = []
+    for _ in range(args.n_grasps):
+        graspit.autoGrasp()
+        states.append((graspit.getRobot().robot, graspit.computeQuality()))
+
+    start = time.time()
+    for robot, quality in states:
+        grasp_from_robot_state(robot, quality, 'body')
+    report('grasp_from_robot_state', len(states), time.time() - start)
+
+    start = time.time()
+    scalar = [grasp_from_robot_state(robot, quality, 'body', kinematics)
+              for robot, quality in states]
+    scalar.sort(key=lambda g: g['quality'], reverse=True)
+    scalar_squeezed = dict(squeezed(scalar))
+    report('grasp_from_robot_state + MANO, sort', len(states), time.time() - start)
+
+    start = time.time()
+    arrays = arrays_from_states([grasp_state_from_robot(r, q, 'body') for r, q in states])
+    arrays = select_grasps(arrays, np.argsort(-arrays['quality'], kind='mergesort'))
+    fingers = squeezed_fingers(arrays['dofs'], arrays['link_mask'])
+    batch_squeezed = dict(
+        (i, squeezed_joints(fingers[i])) for i in np.flatnonzero(fingers.any(axis=1)))
+    batch = grasps_from_states('body', arrays, kinematics)
+    report('arrays_from_states + MANO, sort', len(states), time.time() - start)
+
+    error = max(
+        max(abs(a[name] - b[name]) for a, b in zip(scalar, batch)
+            for name in ['quality', 'epsilon', 'volume']),
+        max(np.abs(np.subtract(a[name], b[name])).max() for a, b in zip(scalar, batch)
+            for name in ['pose', 'dofs', 'mano_trans', 'mano_pose']))
+    same = scalar_squeezed == batch_squeezed and all(
+        sorted(a['link_in_contact']) == sorted(b['link_in_contact']) and
+        [c['link'] for c in a['contacts']] == [c['link'] for c in b['contacts']]
+        for a, b in zip(scalar, batch))
+    print('{:<40} {:>10.1e}'.format('max abs difference', error))
+    print('{:<40} {:>10}'.format('same links and squeezed fingers', str(same)))
+
+
+def bench_scene(args):
+    graspit = SimulatedCommander(latency_scale=0, failure_rate=0)
+    scene = GraspitScene(graspit, 'ManoHand', 'body', robots_dir=args.robots_dir)
+    plans = scene.planGrasps()
+    jobs = [(plans[i % len(plans)]['pose'], plans[i % len(plans)]['dofs'], {})
+            for i in range(args.n_grasps)]
+
+    start = time.time()
+    for pose, dofs, variant in jobs:
+        scene.grasp(pose, dofs, 'body', **variant)
+    report('GraspitScene.grasp overhead', len(jobs), time.time() - start)
+
+
+def bench_miner(args):
+    process = SimulatedProcess(robots_dir=args.robots_dir, latency_scale=args.latency_scale)
+    miner = GraspMiner(process, max_steps=args.max_steps)
+
+    start = time.time()
+    for i in range(args.n_objects):
+        miner('body_{}'.format(i))
+    report('GraspMiner', args.n_objects, time.time() - start, 'objects')
+
+
+def bench_speeds(args):
+    # speed ratio models are symlinks to the same model, as installed by setup.py
+    robots_dir = tempfile.mkdtemp()
+    try:
+        os.symlink(os.path.abspath(os.path.join(args.robots_dir, 'ManoHand')),
+                   os.path.join(robots_dir, 'ManoHand'))
+        for ver in ['v2', 'v3']:
+            os.symlink(os.path.join(robots_dir, 'ManoHand'),
+                       os.path.join(robots_dir, 'ManoHand_{}'.format(ver)))
+        for share_plans in [False, True]:
+            process = SimulatedProcess(robots_dir=robots_dir, latency_scale=args.latency_scale)
+            miner = GraspMiner(process,
+                               max_steps=args.max_steps,
+                               change_speed=True,
+                               share_plans=share_plans)
+            plan_time, exec_time = 0.0, 0.0
+            start = time.time()
+            for i in range(args.n_objects):
+                miner('body_{}'.format(i))
+                plan_time += miner.stats['plan_time']
+                exec_time += miner.stats['exec_time']
+            report('GraspMiner change_speed share_plans={}'.format(share_plans), args.n_objects,
+                   time.time() - start, 'objects')
+            print('{:<40} {:>10.1%}'.format('planning time share',
+                                            plan_time / (plan_time + exec_time)))
+    finally:
+        shutil.rmtree(robots_dir)
+
+
+def bench_variants(args):
+    for adaptive_variants in [0, 2, 1]:
+        process = SimulatedProcess(robots_dir=args.robots_dir, latency_scale=args.latency_scale)
+        miner = GraspMiner(process, max_steps=args.max_steps, adaptive_variants=adaptive_variants)
+        simulations, n_grasps, quality = 0, 0, 0.0
+        start = time.time()
+        for i in range(args.n_objects):
+            _, grasps = miner('body_{}'.format(i))
+            simulations += miner.stats['simulations']
+            n_grasps += len(grasps)
+            quality += sum(g['quality'] for g in grasps)
+        report('GraspMiner adaptive_variants={}'.format(adaptive_variants), args.n_objects,
+               time.time() - start, 'objects')
+        print('{:<40} {:>10}'.format('simulations', simulations))
+        print('{:<40} {:>10}'.format('grasps', n_grasps))
+        print('{:<40} {:>10.4f}'.format('mean quality', quality / max(n_grasps, 1)))
+
+
+def write_ball(objects_dir, name, radius=40.0, n=24):
+    """Write a UV sphere graspable body
+
+    Arguments:
+        objects_dir {str} -- GraspIt graspable bodies directory
+        name {str} -- body name
+
+    Keyword Arguments:
+        radius {float} -- sphere radius, millimeters (default: {40.0})
+        n {int} -- number of parallels (default: {24})
+    """
+    theta, phi = np.meshgrid(np.linspace(0, np.pi, n + 1)[1:-1],
+                             np.linspace(0, 2 * np.pi, 2 * n, endpoint=False),
+                             indexing='ij')
+    vertices = np.concatenate([[[0, 0, 1]],
+                               np.stack([np.sin(theta) * np.cos(phi),
+                                         np.sin(theta) * np.sin(phi),
+                                         np.cos(theta)], axis=2).reshape(-1, 3),
+                               [[0, 0, -1]]]) * radius
+    ring = np.arange(2 * n)
+    faces = [(0, 1 + j, 1 + (j + 1) % (2 * n)) for j in ring]
+    for i in range(n - 2):
+        a, b = 1 + i * 2 * n + ring, 1 + i * 2 * n + (ring + 1) % (2 * n)
+        faces += list(zip(a, a + 2 * n, b)) + list(zip(b, a + 2 * n, b + 2 * n))
+    last = len(vertices) - 1
+    faces += [(last, last - 2 * n + (j + 1) % (2 * n), last - 2 * n + j) for j in ring]
+
+    with open(os.path.join(objects_dir, '{}.off'.format(name)), 'w') as f:
+        f.write('OFF\n{} {} 0\n'.format(len(vertices), len(faces)))
+        f.writelines('{} {} {}\n'.format(*v) for v in vertices)
+        f.writelines('3 {} {} {}\n'.format(*face) for face in faces)
+    with open(os.path.join(objects_dir, '{}.xml'.format(name)), 'w') as f:
+        f.write('<root><geometryFile type="off">{}.off</geometryFile></root>\n'.format(name))
+
+
+def bench_prefilter(args):
+    objects_dir = tempfile.mkdtemp()
+    try:
+        for i in range(args.n_objects):
+            write_ball(objects_dir, 'body_{}'.format(i), radius=30.0 + 5 * i)
+
+        # distance grid against the exact sphere
+        vertices, faces = load_mesh(os.path.join(objects_dir, 'body_0.off'))
+        start = time.time()
+        distance = ObjectDistance(vertices * 0.001, faces, 0.05)
+        report('ObjectDistance build', 1, time.time() - start, 'objects')
+        points = np.random.RandomState(0).uniform(-0.1, 0.1, size=(args.n_grasps, 3))
+        start = time.time()
+        lower, inside = distance.distance(points), distance.inside(points)
+        report('ObjectDistance distance + inside', len(points), time.time() - start, 'points')
+        # inf stands for beyond max_distance, the tolerance covers the mesh chords
+        exact = np.abs(np.linalg.norm(points, axis=1) - 0.03)
+        violations = np.where(np.isinf(lower), exact <= 0.05 - 1e-4, lower > exact + 1e-4)
+        print('{:<40} {:>10}'.format('lower bound violations', np.sum(violations)))
+        print('{:<40} {:>10}'.format('inside mismatches',
+                                     np.sum(inside != (np.linalg.norm(points, axis=1) < 0.03))))
+
+        for prefilter in [None, PlanPrefilter(objects_dir)]:
+            process = SimulatedProcess(robots_dir=args.robots_dir,
+                                       latency_scale=args.latency_scale)
+            miner = GraspMiner(process, max_steps=args.max_steps, prefilter=prefilter)
+            totals = dict(plans=0, plans_rejected=0, prefilter_time=0.0, sim_time_rejected=0.0)
+            start = time.time()
+            for i in range(args.n_objects):
+                miner('body_{}'.format(i))
+                for name in totals:
+                    totals[name] += miner.stats[name]
+            report('GraspMiner prefilter={}'.format(prefilter is not None), args.n_objects,
+                   time.time() - start, 'objects')
+            if prefilter is not None:
+                print('{:<40} {:>10}'.format('plans rejected', '{plans_rejected}/{plans}'.format(
+                    **totals)))
+                print('{:<40} {:>10.2f} s, {:.2f} s simulation saved'.format(
+                    'prefilter time', totals['prefilter_time'], totals['sim_time_rejected']))
+    finally:
+        shutil.rmtree(objects_dir)
+
+
+def bench_startup(args):
+    for n_jobs in args.n_jobs:
+        pool = GraspitPool(GraspMiner,
+                           n_jobs,
+                           process_class=SimulatedProcess,
+                           robots_dir=args.robots_dir,
+                           startup=1.0)
+        start = time.time()
+        pool.start()
+        elapsed = time.time() - start
+        startup = sum(stats['startup'] for stats in pool.utilization())
+        pool.join()
+        print('{:<40} {:>10.2f} s, {:.2f} s sequential'.format(
+            'GraspitPool start n_jobs={}'.format(n_jobs), elapsed, startup))
+
+
+def bench_pool(args):
+    base = None
+    for n_jobs in args.n_jobs:
+        with GraspitPool(partial(GraspMiner, max_steps=args.max_steps),
+                         n_jobs,
+                         process_class=SimulatedProcess,
+                         robots_dir=args.robots_dir,
+                         latency_scale=args.latency_scale) as pool:
+            start = time.time()
+            for _ in pool.imap('body_{}'.format(i) for i in range(args.n_objects)):
+                pass
+            elapsed = time.time() - start
+        base = base or elapsed * n_jobs
+        report('GraspitPool n_jobs={}'.format(n_jobs), args.n_objects, elapsed, 'objects')
+        print('{:<40} {:>10.0%}'.format('parallel efficiency', base / elapsed / n_jobs))
+
+
+def bench_shards(args):
+    base = None
+    for n_shards in args.n_jobs:
+        executor = ShardExecutor(n_shards,
+                                 process_class=SimulatedProcess,
+                                 robots_dir=args.robots_dir,
+                                 latency_scale=args.latency_scale)
+        process = SimulatedProcess(robots_dir=args.robots_dir,
+                                   latency_scale=args.latency_scale,
+                                   n_plans=200)
+        miner = GraspMiner(process, max_steps=args.max_steps, shard_executor=executor)
+        try:
+            miner('body')  # warm up shard instances
+            start = time.time()
+            for i in range(args.n_objects):
+                miner('body_{}'.format(i))
+            elapsed = time.time() - start
+        finally:
+            miner.close()
+        base = base or elapsed * n_shards
+        report('GraspMiner shards={}'.format(n_shards), args.n_objects, elapsed, 'objects')
+        print('{:<40} {:>10.0%}'.format('parallel efficiency', base / elapsed / n_shards))
+
+
+def main(args):
+    for name in args.benchmarks:
+        globals()['bench_{}'.format(name)](args)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
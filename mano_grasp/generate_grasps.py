@@ -3,11 +3,25 @@
 import argparse
 import json
 import os
+import socket
 import time
+import traceback
+from functools import partial
 
+from graspit_pool import GraspitPool
 from graspit_process import GraspitProcess
 from graspit_scene import GraspitScene
-from grasp_miner import GraspMiner
+from grasp_miner import VARIANTS, GraspMiner
+from grasp_catalog import GraspCatalog
+from grasp_store import GraspStoreWriter
+from grasp_writer import GraspWriter, open_reader
+from job_queue import JobQueue
+from plan_filter import PlanPrefilter
+from profiler import Profiler
+from result_cache import ResultCache
+from scheduler import Scheduler
+from shard_executor import ShardExecutor
+from xvfb import XvfbServer
 
 parser = argparse.ArgumentParser(description='Grasp mining')
 parser.add_argument('-m', '--models', nargs='*', default=['glass'])
@@ -21,6 +35,17 @@ parser.add_argument('-x',
                     '--xvfb',
                     action='store_true',
                     help="Start with Xserver Virtual Frame Buffer (Xvfb)")
+parser.add_argument('--start_timeout',
+                    type=float,
+                    default=15.0,
+                    help="Max time to wait for a GraspIt instance to start, seconds")
+parser.add_argument('--start_retries',
+                    type=int,
+                    default=2,
+                    help="Restarts of a GraspIt instance which failed to start")
+parser.add_argument('--shared_xvfb',
+                    action='store_true',
+                    help="Start a single Xvfb server shared by all GraspIt instances")
 parser.add_argument('--graspit_dir',
                     type=str,
                     default=os.environ['GRASPIT'],
@@ -30,11 +55,126 @@ parser.add_argument('--plugin_dir',
                     default=os.environ['GRASPIT_PLUGIN_DIR'],
                     help="Path to directory with a graspit_interface plugin")
 parser.add_argument('-s', '--max_steps', type=int, default=0, help="Max search steps per object")
+parser.add_argument('--plan_increment',
+                    type=int,
+                    default=0,
+                    help="Plan in searches of N steps and stop once plans stop improving, "
+                    "every search starts from scratch")
+parser.add_argument('--plan_patience',
+                    type=int,
+                    default=2,
+                    help="Planning chunks without improvement before stopping")
+parser.add_argument('--plan_tolerance',
+                    type=float,
+                    default=0.01,
+                    help="Relative improvement of top plans quality or distinct plans count")
+parser.add_argument('--max_plan_time',
+                    type=float,
+                    default=0,
+                    help="Planning time limit per hand model, seconds")
 parser.add_argument('-g', '--max_grasps', type=int, default=0, help="Max best grasps per object")
 parser.add_argument('--relax_fingers',
                     action='store_true',
                     help="Randomize squezzed fingers positions")
+parser.add_argument('--relax_budget',
+                    type=int,
+                    default=20,
+                    help="Max simulations to relax fingers of a grasp")
+parser.add_argument('--relax_best_of',
+                    type=int,
+                    default=1,
+                    help="Keep the best of N relaxed candidates, 1 stops at the first one")
+parser.add_argument('--dedup_plans',
+                    action='store_true',
+                    help="Drop near-duplicate plans before execution")
+parser.add_argument('--dedup_tolerance',
+                    type=float,
+                    nargs=3,
+                    default=[0.005, 0.1, 0.1],
+                    metavar=('POSITION', 'ORIENTATION', 'DOFS'),
+                    help="Plans closer than all tolerances (meters, radians) are duplicates")
+parser.add_argument('--adaptive_variants',
+                    type=int,
+                    default=0,
+                    help="Execute every plan with N variants paying off the most on the object, "
+                    "0 executes all of them")
+parser.add_argument('--variant_epsilon',
+                    type=float,
+                    default=0.1,
+                    help="Chance to try a random variant in the adaptive mode")
+parser.add_argument('--prefilter',
+                    action='store_true',
+                    help="Drop plans far from the object or penetrating it before execution")
+parser.add_argument('--prefilter_distance',
+                    type=float,
+                    nargs=2,
+                    default=[0.05, 0.01],
+                    metavar=('MAX_DISTANCE', 'MAX_DEPTH'),
+                    help="Max distance of the palm and fingertips to the object and max "
+                    "penetration into it, meters")
+parser.add_argument('-w',
+                    '--warm_start',
+                    type=str,
+                    default='',
+                    help="Replay grasps from a previous output directory before planning")
+parser.add_argument('--warm_steps',
+                    type=int,
+                    default=10000,
+                    help="Max search steps per object with previous grasps, 0 only replays them")
+parser.add_argument('--seed', type=int, default=0, help="Random seed of fingers relaxation")
+parser.add_argument('-c',
+                    '--cache',
+                    type=str,
+                    default='',
+                    help="Reuse grasps of unchanged objects and parameters from a cache directory")
+parser.add_argument('--cache_size', type=float, default=10.0, help="Cache size limit, GB")
+parser.add_argument('--shards',
+                    type=int,
+                    default=0,
+                    help="Execute plans of an object on N extra GraspIt instances")
+parser.add_argument('--profile',
+                    type=str,
+                    default='',
+                    help="Record GraspIt calls and write the profile to a JSON file")
+parser.add_argument('-r',
+                    '--resume',
+                    action='store_true',
+                    help="Skip objects which grasps are already saved")
+parser.add_argument('--longest_first',
+                    action='store_true',
+                    help="Process objects with the longest expected duration first")
+parser.add_argument('--objects_dir',
+                    type=str,
+                    default='',
+                    help="Path to GraspIt objects directory with meshes used by --longest_first "
+                    "and --cache (default: GRASPIT/models/objects)")
+parser.add_argument('-q',
+                    '--queue',
+                    type=str,
+                    default='',
+                    help="Lease objects from a shared job queue directory instead of --models")
+parser.add_argument('--lease_time',
+                    type=float,
+                    default=600.0,
+                    help="Queue lease expiry time, seconds")
+parser.add_argument('-f',
+                    '--format',
+                    choices=['json', 'store'],
+                    default='json',
+                    help="Output format: a <body>.json per object or a columnar grasp store")
+parser.add_argument('--catalog',
+                    action='store_true',
+                    help="Index saved objects in catalog.sqlite of the output directory")
 parser.add_argument('--change_speed', action='store_true', help="Try several joint's speed ratios")
+parser.add_argument('--share_plans',
+                    action='store_true',
+                    help="Plan once and execute the plans with every speed ratio")
+
+
+def format_stats(stats):
+    """Format object statistics as a single line"""
+    values = [(k, '{:.3f}'.format(v) if isinstance(v, float) else v) for k, v in stats.items()]
+    return ', '.join('{}: {}'.format(k, v) for k, v in sorted(values))
 
 
 def main(args):
@@ -54,6 +194,17 @@ def main(args):
         print('Output directory not specified')
         exit(0)
 
+    if args.queue and args.format == 'store':
+        # the store is appended at offsets known to a single writer only
+        print('A grasp store cannot be shared by queue workers, use --format json')
+        exit(0)
+
+    if args.queue and args.catalog:
+        # SQLite locking is unreliable on network file systems
+        print('A catalog cannot be shared by queue workers, build it after the run with '
+              'python -m mano_grasp.grasp_catalog PATH_OUT --build')
+        exit(0)
+
     if not os.path.isdir(args.path_out):
         os.makedirs(args.path_out)
 
@@ -61,39 +212,208 @@ def main(args):
         models = args.models
     else:
         with open(args.models_file) as f:
-            models = f.readlines()
-
-    proccess = GraspitProcess(graspit_dir=args.graspit_dir,
-                              plugin_dir=args.plugin_dir,
-                              headless=args.headless,
-                              xvfb_run=args.xvfb,
-                              verbose=args.verbose)
-
-    generator = GraspMiner(graspit_process=proccess,
-                           max_steps=args.max_steps,
-                           max_grasps=args.max_grasps,
-                           relax_fingers=args.relax_fingers,
-                           change_speed=args.change_speed)
-
-    if args.n_jobs > 1:
-        from joblib import Parallel, delayed
-        grasps = Parallel(n_jobs=args.n_jobs, verbose=50)(delayed(generator)(m) for m in models)
+            models = [line.strip() for line in f if line.strip()]
+
+    process_args = dict(graspit_dir=args.graspit_dir,
+                        plugin_dir=args.plugin_dir,
+                        headless=args.headless,
+                        xvfb_run=args.xvfb,
+                        verbose=args.verbose,
+                        start_timeout=args.start_timeout,
+                        start_retries=args.start_retries)
+
+    xvfb = None
+    if args.shared_xvfb:
+        xvfb = XvfbServer()
+        xvfb.start()
+        process_args.update(display=xvfb.display, xvfb_run=False)
+        # every instance would start an X server of its own with xvfb-run,
+        # the saving is estimated assuming each of them is as large as the shared one
+        n_instances = max(args.n_jobs, 1) * (1 + args.shards)
+        rss = xvfb.rss() or 0
+        print('Shared Xvfb {} started in {:.2f} s, {:.0f} MB resident, shared by {} GraspIt '
+              'instances (estimated saving vs xvfb-run: {:.0f} MB, {:.2f} s startup per '
+              'instance)'.format(xvfb.display, xvfb.startup_time, rss / 2.0**20, n_instances,
+                                 (n_instances - 1) * rss / 2.0**20, xvfb.startup_time))
+
+    profiler = Profiler(enabled=bool(args.profile))
+
+    miner_args = dict(profiler=profiler,
+                      max_steps=args.max_steps,
+                      max_grasps=args.max_grasps,
+                      plan_increment=args.plan_increment,
+                      plan_patience=args.plan_patience,
+                      plan_tolerance=args.plan_tolerance,
+                      max_plan_time=args.max_plan_time,
+                      relax_fingers=args.relax_fingers,
+                      relax_budget=args.relax_budget,
+                      relax_best_of=args.relax_best_of,
+                      change_speed=args.change_speed,
+                      share_plans=args.share_plans,
+                      seed=args.seed,
+                      adaptive_variants=args.adaptive_variants,
+                      variant_epsilon=args.variant_epsilon,
+                      dedup_tolerance=args.dedup_tolerance if args.dedup_plans else None)
+    if args.warm_start:
+        miner_args['warm_start'] = open_reader(args.warm_start)
+        miner_args['warm_steps'] = args.warm_steps
+
+    objects_dir = args.objects_dir or os.path.join(args.graspit_dir, 'models', 'objects')
+    if args.cache:
+        miner_args['result_cache'] = ResultCache(args.cache, objects_dir,
+                                                 int(args.cache_size * 2**30))
+    if args.prefilter:
+        miner_args['prefilter'] = PlanPrefilter(objects_dir, *args.prefilter_distance)
+    if args.shards > 0:
+        # every miner starts its own shard instances on first use
+        miner_args['shard_executor'] = ShardExecutor(args.shards, profiler=profiler,
+                                                     **process_args)
+
+    if args.format == 'store':
+        writer = GraspStoreWriter(args.path_out)
+    else:
+        writer = GraspWriter(args.path_out)
+    # index of the output, updated as objects are saved
+    catalog = GraspCatalog(args.path_out) if args.catalog else None
+
+    # durations of all runs are recorded next to the output
+    scheduler = Scheduler(objects_dir, os.path.join(args.path_out, 'timings.jsonl'))
+    if args.longest_first:
+        models = scheduler.order(models)
+
+    queue = None
+    if args.queue:
+        queue = JobQueue(args.queue, lease_time=args.lease_time)
+        print(queue)
+
+        def leased():
+            for body_name in queue.leases():
+                if body_name is not None and args.resume and writer.exists(body_name):
+                    queue.complete(body_name)
+                    continue
+                yield body_name
+
+        pending = leased()
+    elif args.resume:
+        pending = [body_name for body_name in models if not writer.exists(body_name)]
+        print('Resume: skipping {} completed objects'.format(len(models) - len(pending)))
     else:
-        grasps = [generator(body) for body in models]
+        pending = models
+
+    plan_steps = {}
+    prefilter = dict(plans=0, rejected=0, time=0.0, saved=0.0)
+
+    # tries, successes and total quality per execution variant,
+    # queue workers keep logs of their own
+    variants = dict((i, [0, 0, 0.0]) for i in range(len(VARIANTS)))
+    variants_log = 'variants.jsonl'
+    if queue is not None:
+        variants_log = 'variants.{}-{}.jsonl'.format(socket.gethostname(), os.getpid())
 
-    for body_name, body_grasps in grasps:
-        print('{}: saving {} grasps'.format(
+    def save(body_name, body_grasps, stats):
+        profiler.merge(stats.pop('profile', []))
+        body_variants = stats.pop('variants', [])
+        if body_variants:
+            with open(os.path.join(args.path_out, variants_log), 'a') as f:
+                f.write(json.dumps(dict(name=body_name, variants=body_variants)) + '\n')
+            for v in body_variants:
+                tally = variants[v['variant']]
+                tally[0] += v['tries']
+                tally[1] += v['successes']
+                tally[2] += v['quality'] * v['successes']
+        if not stats.get('cache_hit'):
+            # unknown when GraspIt chose the step budget itself
+            if 'plan_steps' in stats:
+                plan_steps[body_name] = stats['plan_steps']
+            prefilter['plans'] += stats.get('plans', 0)
+            prefilter['rejected'] += stats.get('plans_rejected', 0)
+            prefilter['time'] += stats.get('prefilter_time', 0.0)
+            prefilter['saved'] += stats.get('sim_time_rejected', 0.0)
+        print('{}: saving {} grasps ({})'.format(
             body_name,
             len(body_grasps),
+            format_stats(stats),
         ))
-        with open(os.path.join(args.path_out, '{}.json'.format(body_name)), 'w') as f:
-            json.dump(body_grasps, f)
+        ranges = writer.write(body_name, body_grasps)
+        if catalog is not None:
+            catalog.add(body_name, body_grasps, ranges)
+        if not stats.get('cache_hit'):
+            scheduler.record(body_name, stats['elapsed'])
+        if queue is not None:
+            queue.complete(body_name)
+
+    try:
+        if args.n_jobs > 1:
+            with GraspitPool(partial(GraspMiner, **miner_args), args.n_jobs,
+                             **process_args) as pool:
+                on_error = queue.fail if queue is not None else None
+                for (body_name, body_grasps), stats in pool.imap(pending, on_error):
+                    save(body_name, body_grasps, stats)
+                utilization = pool.utilization()
+            for stats in utilization:
+                if stats['startup'] is None:
+                    print('GraspIt worker {worker}: not started'.format(**stats))
+                else:
+                    print('GraspIt worker {worker}: startup {startup:.1f} s, {attempts} attempts, '
+                          '{objects} objects, {failed} failed, busy {busy:.1f} s '
+                          '({utilization:.0%})'.format(**stats))
+        else:
+            generator = GraspMiner(GraspitProcess(**process_args), **miner_args)
+            try:
+                for body in pending:
+                    if body is None:
+                        continue  # nothing to lease yet
+                    started = time.time()
+                    try:
+                        body_name, body_grasps = generator(body)
+                    except Exception:
+                        if queue is None:
+                            raise
+                        # a failed object is retried by the queue
+                        print('{}: failed\n{}'.format(body, traceback.format_exc()))
+                        queue.fail(body)
+                        continue
+                    save(body_name, body_grasps,
+                         dict(generator.stats, elapsed=time.time() - started))
+            finally:
+                generator.close()
+    finally:
+        if queue is not None:
+            queue.release()
+            print(queue)
+        if xvfb is not None:
+            xvfb.join()
+
+    if plan_steps:
+        steps = list(plan_steps.values())
+        print('Planner steps per object: mean {:.0f}, min {}, max {}, total {}'.format(
+            float(sum(steps)) / len(steps), min(steps), max(steps), sum(steps)))
+
+    for i, variant in enumerate(VARIANTS):
+        tries, successes, quality = variants[i]
+        if tries:
+            print('Variant {} ({}): {} simulations, {:.0%} success, mean quality {:.3f}'.format(
+                i, format_stats(variant), tries,
+                float(successes) / tries, quality / max(successes, 1)))
+
+    if args.prefilter:
+        print('Prefilter: {rejected} of {plans} plans rejected in {time:.1f} s, '
+              'estimated {saved:.1f} s of simulation saved'.format(**prefilter))
+
+    if args.cache:
+        print('Cache: {}'.format(miner_args['result_cache'].report()))
+
+    if profiler.enabled:
+        profiler.dump(args.profile)
+        print(profiler.summary())
 
     if args.debug:
         with GraspitProcess(graspit_dir=args.graspit_dir, plugin_dir=args.plugin_dir) as p:
-            for body_name, body_grasps in grasps:
-                scene = GraspitScene(p.graspit, 'ManoHand', body_name)
-                for grasp in body_grasps:
+            for body_name in models:
+                if not writer.exists(body_name):
+                    continue
+                scene = GraspitScene(p.graspit, 'ManoHand', body_name, robots_dir=p.robots_dir)
+                for grasp in writer.read(body_name):
                     scene.grasp(grasp['pose'], grasp['dofs'])
                     time.sleep(5.0)
 
@@ -0,0 +1,317 @@
+#!/usr/bin/env python2
+
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from grasp_store import GraspStore, grasps_from_arrays
+from grasp_utils import select_grasps
+from grasp_writer import GraspWriter
+from kinematics import LINK_ID, LINK_NAMES
+
+parser = argparse.ArgumentParser(description='Query mined grasps through the dataset catalog')
+parser.add_argument('path', type=str, help="Directory with mined grasps (JSON or grasp store)")
+parser.add_argument('-m', '--models', nargs='*', default=[], help="Objects (default: all)")
+parser.add_argument('-k', '--top_k', type=int, default=0, help="N best grasps per object")
+parser.add_argument('-q', '--min_quality', type=float, default=None, help="Quality threshold")
+parser.add_argument('-l',
+                    '--links',
+                    nargs='*',
+                    default=[],
+                    choices=LINK_NAMES,
+                    help="Links which must be in contact")
+parser.add_argument('-n', '--limit', type=int, default=0, help="N best grasps overall")
+parser.add_argument('-o', '--output', type=str, default='', help="Save selected grasps to a JSON")
+parser.add_argument('-s', '--summary', action='store_true', help="Print per object statistics")
+parser.add_argument('--build', action='store_true', help="Index objects missing in the catalog")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    name TEXT PRIMARY KEY,
+    n_grasps INTEGER,
+    quality_min REAL,
+    quality_p50 REAL,
+    quality_p90 REAL,
+    quality_max REAL,
+    quality_mean REAL,
+    link_counts TEXT
+);
+CREATE TABLE IF NOT EXISTS grasps (
+    object TEXT,
+    idx INTEGER,
+    quality REAL,
+    link_mask INTEGER,
+    byte_offset INTEGER,
+    byte_length INTEGER,
+    PRIMARY KEY (object, idx)
+);
+CREATE INDEX IF NOT EXISTS grasps_quality ON grasps (quality);
+"""
+
+MAX_PARAMS = 999
+
+
+def link_mask(links):
+    """Bitmask of link ids
+
+    Arguments:
+        links {list} -- link names
+
+    Returns:
+        int -- bit per link, see LINK_ID
+    """
+    return sum(1 << LINK_ID[link] for link in set(links))
+
+
+class GraspCatalog:
+    """ Index of mined grasps
+
+    A SQLite database next to the mined grasps holds per object
+    statistics (grasp count, quality distribution, link contact counts)
+    and per grasp quality, links in contact and the byte range of the
+    grasp in <body>.json. Queries are answered from the index and only
+    the selected grasps are read.
+
+    """
+
+    def __init__(self, path):
+        """Constructor
+
+        Arguments:
+            path {str} -- directory with mined grasps, JSON or grasp store
+        """
+        self._path = path
+        self._db = sqlite3.connect(os.path.join(path, 'catalog.sqlite'), timeout=60)
+        self._db.executescript(SCHEMA)
+
+    @property
+    def names(self):
+        """ Names of indexed objects """
+        return [row[0] for row in self._db.execute('SELECT name FROM objects ORDER BY name')]
+
+    def exists(self, body_name):
+        return self._db.execute('SELECT 1 FROM objects WHERE name = ?',
+                                (body_name,)).fetchone() is not None
+
+    def add(self, body_name, grasps, ranges=None):
+        """Index grasps of the object, replaces a previous entry
+
+        Arguments:
+            body_name {str} -- object name
+            grasps {list} -- object grasps
+
+        Keyword Arguments:
+            ranges {list} -- byte ranges of grasps as returned by GraspWriter.write,
+                None for a grasp store (default: {None})
+        """
+        quality = np.array([g['quality'] for g in grasps], dtype=np.float64)
+        masks = [link_mask(g['link_in_contact']) for g in grasps]
+        link_counts = dict((name, sum(1 for m in masks if m >> i & 1))
+                           for i, name in enumerate(LINK_NAMES))
+        if len(quality):
+            p50, p90 = np.percentile(quality, [50, 90])
+            stats = (quality.min(), p50, p90, quality.max(), quality.mean())
+        else:
+            stats = (None,) * 5
+        ranges = ranges or [(None, None)] * len(grasps)
+        with self._db:
+            self._db.execute('DELETE FROM grasps WHERE object = ?', (body_name,))
+            self._db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (body_name, len(grasps)) + tuple(map(_float, stats)) +
+                             (json.dumps(link_counts),))
+            self._db.executemany(
+                'INSERT INTO grasps VALUES (?, ?, ?, ?, ?, ?)',
+                ((body_name, i, float(q), m, offset, length)
+                 for i, (q, m, (offset, length)) in enumerate(zip(quality, masks, ranges))))
+
+    def build(self, names=None):
+        """Index objects of the directory which are not indexed yet
+
+        Arguments:
+            names {list} -- objects to index (default: {all})
+
+        Returns:
+            int -- number of indexed objects
+        """
+        reader = self._reader()
+        indexed = set(self.names)
+        added = 0
+        for body_name in names or reader.names:
+            if body_name in indexed or not reader.exists(body_name):
+                continue
+            if isinstance(reader, GraspStore):
+                self.add(body_name, reader.read(body_name))
+            else:
+                self.add(body_name, *_scanJson(reader.filename(body_name)))
+            added += 1
+        return added
+
+    def summary(self, names=None):
+        """Per object statistics
+
+        Keyword Arguments:
+            names {list} -- objects (default: {all})
+
+        Returns:
+            list -- dicts with name, n_grasps, quality_min, quality_p50, quality_p90,
+                quality_max, quality_mean and link_counts
+        """
+        cursor = self._db.execute('SELECT * FROM objects ORDER BY name')
+        columns = [c[0] for c in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor]
+        for row in rows:
+            row['link_counts'] = json.loads(row['link_counts'])
+        return [row for row in rows if not names or row['name'] in names]
+
+    def query(self, top_k=0, min_quality=None, links=(), names=(), limit=0):
+        """Select grasps by quality and links in contact
+
+        Arguments:
+            top_k {int} -- N best matching grasps per object, 0 for all (default: {0})
+            min_quality {float} -- quality threshold (default: {None})
+            links {list} -- links which must be in contact (default: {()})
+            names {list} -- objects, empty for all (default: {()})
+            limit {int} -- N best matching grasps overall, 0 for all (default: {0})
+
+        Returns:
+            list -- (object, index, quality) tuples, best first
+        """
+        where, params = [], []
+        if min_quality is not None:
+            where.append('quality >= ?')
+            params.append(min_quality)
+        if links:
+            where.append('link_mask & ? = ?')
+            params += [link_mask(links)] * 2
+        if names:
+            # any number of names, SQLite before 3.32 binds at most 999 parameters
+            with self._db:
+                self._db.execute('CREATE TEMP TABLE IF NOT EXISTS query_names (name TEXT)')
+                self._db.execute('DELETE FROM query_names')
+                self._db.executemany('INSERT INTO query_names VALUES (?)',
+                                     ((name,) for name in names))
+            where.append('object IN (SELECT name FROM query_names)')
+        sql = 'SELECT object, idx, quality FROM grasps'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        if top_k > 0:
+            # window functions need SQLite 3.25, so the cut is done while streaming
+            cursor = self._db.execute(sql + ' ORDER BY object, quality DESC, idx', params)
+            rows = [
+                row for _, group in itertools.groupby(cursor, key=lambda row: row[0])
+                for row in itertools.islice(group, top_k)
+            ]
+            rows.sort(key=lambda row: -row[2])
+            return rows[:limit] if limit > 0 else rows
+
+        sql += ' ORDER BY quality DESC'
+        if limit > 0:
+            sql += ' LIMIT {:d}'.format(limit)
+        return self._db.execute(sql, params).fetchall()
+
+    def load(self, rows):
+        """Read selected grasps
+
+        Arguments:
+            rows {list} -- (object, index, ...) tuples as returned by query
+
+        Returns:
+            list -- grasps in rows order
+        """
+        reader = self._reader()
+        grasps = [None] * len(rows)
+        by_object = {}
+        for i, row in enumerate(rows):
+            by_object.setdefault(row[0], []).append((i, row[1]))
+        for body_name, items in by_object.items():
+            index = [idx for _, idx in items]
+            if isinstance(reader, GraspStore):
+                arrays = select_grasps(reader[body_name], index)
+                selected = grasps_from_arrays(body_name, arrays)
+            else:
+                ranges = {}
+                # SQLite before 3.32 binds at most 999 parameters
+                for i in range(0, len(index), MAX_PARAMS - 1):
+                    chunk = index[i:i + MAX_PARAMS - 1]
+                    sql = ('SELECT idx, byte_offset, byte_length FROM grasps '
+                           'WHERE object = ? AND idx IN ({})'.format(', '.join('?' * len(chunk))))
+                    for idx, offset, length in self._db.execute(sql, [body_name] + chunk):
+                        ranges[idx] = (offset, length)
+                selected = reader.readAt(body_name, [ranges[idx] for idx in index])
+            for (i, _), grasp in zip(items, selected):
+                grasps[i] = grasp
+        return grasps
+
+    def close(self):
+        self._db.close()
+
+    def _reader(self):
+        if os.path.isfile(os.path.join(self._path, 'meta.json')):
+            return GraspStore(self._path)
+        return GraspWriter(self._path)
+
+    def __repr__(self):
+        return "Grasp catalog: {}".format(self._path)
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def _scanJson(filename):
+    """ Grasps of a <body>.json file with their byte ranges """
+    with open(filename, 'rb') as f:
+        text = f.read().decode('utf-8')
+    decoder = json.JSONDecoder()
+    grasps, ranges = [], []
+    pos = text.index('[') + 1
+    last, byte_pos = 0, 0
+    while True:
+        while text[pos] in ' \t\r\n,':
+            pos += 1
+        if text[pos] == ']':
+            break
+        grasp, end = decoder.raw_decode(text, pos)
+        byte_pos += len(text[last:pos].encode('utf-8'))
+        length = len(text[pos:end].encode('utf-8'))
+        grasps.append(grasp)
+        ranges.append((byte_pos, length))
+        byte_pos += length
+        last = pos = end
+    return grasps, ranges
+
+
+def main(args):
+    catalog = GraspCatalog(args.path)
+    if args.build:
+        print('Indexed {} objects'.format(catalog.build(args.models)))
+
+    if args.summary:
+        for row in catalog.summary(args.models):
+            links = ', '.join('{}: {}'.format(name, row['link_counts'][name])
+                              for name in LINK_NAMES if row['link_counts'][name])
+            if row['n_grasps']:
+                print('{name}: {n_grasps} grasps, quality min {quality_min:.3f}, '
+                      'median {quality_p50:.3f}, p90 {quality_p90:.3f}, '
+                      'max {quality_max:.3f} ({})'.format(links, **row))
+            else:
+                print('{name}: 0 grasps'.format(**row))
+
+    if args.top_k or args.min_quality is not None or args.links or args.limit or args.output:
+        rows = catalog.query(args.top_k, args.min_quality, args.links, args.models, args.limit)
+        print('{} grasps of {} objects selected'.format(len(rows), len(set(r[0] for r in rows))))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(catalog.load(rows), f)
+        else:
+            for body_name, idx, quality in rows:
+                print('{} {} {:.4f}'.format(body_name, idx, quality))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -1,7 +1,24 @@
+import hashlib
+import json
+import os
+import time
+
 from graspit_process import GraspitProcess
 from graspit_scene import GraspitScene
 from kinematics import Kinematics
 from grasp_utils import *
+from plan_filter import PlanDeduplicator
+from profiler import Profiler
+
+# grasp execution heuristics
+VARIANTS = (
+    dict(approach=False, auto_open=False),  #
+    dict(approach=False, auto_open=True, full_open=True),
+    dict(approach=True, auto_open=True, full_open=False),
+    dict(approach=True, auto_open=True, full_open=True))
+
+# plans per GraspIt instance executed between updates of adaptive variants selection
+ADAPTIVE_ROUND = 8
 
 
 class GraspMiner:
@@ -11,8 +28,25 @@ class GraspMiner:
                  graspit_process,
                  max_steps=0,
                  max_grasps=0,
+                 plan_increment=0,
+                 plan_patience=2,
+                 plan_tolerance=0.01,
+                 max_plan_time=0,
                  relax_fingers=False,
-                 change_speed=False):
+                 relax_budget=20,
+                 relax_best_of=1,
+                 change_speed=False,
+                 share_plans=False,
+                 dedup_tolerance=None,
+                 adaptive_variants=0,
+                 variant_epsilon=0.1,
+                 prefilter=None,
+                 shard_executor=None,
+                 result_cache=None,
+                 warm_start=None,
+                 warm_steps=10000,
+                 seed=0,
+                 profiler=None):
         """Constructor
         
         Arguments:
@@ -21,18 +55,89 @@ class GraspMiner:
         Keyword Arguments:
             max_steps {int} -- max search steps per object (default: {auto})
             max_grasps {int} -- return only N best grasps per object (default: {auto})
+            plan_increment {int} -- plan in chunks of N steps and stop once plans stop
+                improving, 0 spends all max_steps at once (default: {0})
+            plan_patience {int} -- chunks without improvement before stopping (default: {2})
+            plan_tolerance {float} -- relative improvement threshold (default: {0.01})
+            max_plan_time {float} -- planning time limit per model, seconds (default: {unlimited})
             change_speed {bool} -- try several joint's speed ratios (default: {False})
+            share_plans {bool} -- plan once and execute the plans with every speed ratio
+                (default: {False})
             relax_fingers {bool} -- randomize angles of squezzed fingers (default: {False})
+            relax_budget {int} -- max simulations to relax a grasp (default: {20})
+            relax_best_of {int} -- stop after N relaxed candidates and keep the best one,
+                1 stops at the first one (default: {1})
+            dedup_tolerance {tuple} -- position, orientation and dofs tolerances to drop
+                near-duplicate plans before execution (default: {None})
+            adaptive_variants {int} -- execute every plan with N variants paying off the most
+                on the object so far, 0 executes all variants (default: {0})
+            variant_epsilon {float} -- chance to pick a random variant instead of the best
+                one in the adaptive mode (default: {0.1})
+            prefilter {PlanPrefilter} -- drop plans far from the object or penetrating it
+                before execution (default: {None})
+            shard_executor {ShardExecutor} -- execute plans on extra GraspIt instances,
+                started on first use (default: {None})
+            result_cache {ResultCache} -- return cached grasps without starting GraspIt
+                (default: {None})
+            warm_start {GraspWriter} -- previously mined grasps replayed before planning,
+                GraspWriter or GraspStoreWriter (default: {None})
+            warm_steps {int} -- max search steps of objects with previous grasps,
+                0 only replays them (default: {10000})
+            seed {int} -- random seed of fingers relaxation (default: {0})
+            profiler {Profiler} -- record GraspIt calls and grasp conversions (default: {None})
         """
         self._process = graspit_process
         self._max_steps = max_steps
         self._max_grasps = max_grasps
+        self._plan_args = dict(increment=plan_increment,
+                               patience=plan_patience,
+                               tolerance=plan_tolerance,
+                               max_time=max_plan_time)
         self._relax_fingers = relax_fingers
+        self._relax_budget = relax_budget
+        self._relax_best_of = relax_best_of
         self._robot_names = ['ManoHand']
+        self._share_plans = share_plans
+        self._stats = {}
+        self._profiler = profiler or Profiler(enabled=False)
+        self._executor = shard_executor
+        self._prefilter = prefilter
+        self._adaptive_variants = adaptive_variants
+        self._variant_epsilon = variant_epsilon
+        self._cache = result_cache
+        self._warm_start = warm_start
+        self._warm_steps = warm_steps
+        self._seed = seed
+        # parameters affecting the result
+        self._params = dict(max_steps=max_steps,
+                            max_grasps=max_grasps,
+                            plan_args=self._plan_args,
+                            relax_fingers=relax_fingers,
+                            relax_budget=relax_budget,
+                            relax_best_of=relax_best_of,
+                            dedup_tolerance=dedup_tolerance,
+                            share_plans=share_plans and change_speed,
+                            seed=seed)
+        if prefilter is not None:
+            self._params['prefilter'] = prefilter.params
+        if 0 < adaptive_variants < len(VARIANTS):
+            self._params['adaptive_variants'] = (adaptive_variants, variant_epsilon)
+        self._deduplicator = None
+        if dedup_tolerance is not None:
+            self._deduplicator = PlanDeduplicator(*dedup_tolerance)
         # we can't change a joints speed ratios on the fly, so use several hand models
         if change_speed:
             self._robot_names += ['ManoHand_v2', 'ManoHand_v3']
 
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @property
+    def stats(self):
+        """ Statistics of the last processed object """
+        return self._stats
+
     def __call__(self, object_name):
         """Generated grasps for specific object
         
@@ -42,57 +147,272 @@ class GraspMiner:
         Returns:
             tuple -- object_name, generated grasps
         """
+        self._stats = dict(round_trips=0,
+                           round_trips_saved=0,
+                           plans=0,
+                           plans_pruned=0,
+                           plans_rejected=0,
+                           prefilter_time=0.0,
+                           sim_time_rejected=0.0,
+                           plan_steps=0,
+                           plan_time=0.0,
+                           exec_time=0.0,
+                           sim_time_saved=0.0,
+                           relaxed=0,
+                           relax_sims=0,
+                           scene_loads=0,
+                           simulations=0,
+                           cache_hit=0,
+                           warm_seeds=0,
+                           variants=[])
+
+        # grasps mined before are replayed instead of a full search
+        warm, params = [], self._params
+        if self._warm_start is not None and self._warm_start.exists(object_name):
+            warm = [
+                dict(pose=g['pose'], dofs=g['dofs'], warm=True)
+                for g in self._warm_start.read(object_name)
+            ]
+            sha = hashlib.sha1(json.dumps(warm, sort_keys=True).encode('utf-8'))
+            params = dict(params, warm_steps=self._warm_steps, warm_start=sha.hexdigest())
+            self._stats['warm_seeds'] = len(warm)
+
+        cache_key = None
+        if self._cache is not None:
+            cache_key = self._cache.key(object_name, self._process.robots_dir, self._robot_names,
+                                        params)
+            if cache_key is not None:
+                grasps = self._cache.get(cache_key, object_name)
+                if grasps is not None:
+                    self._stats['cache_hit'] = 1
+                    return (object_name, grasps)
+
         if not self._process.run:
+            # shard instances start while the main one is starting
+            if self._executor is not None and not self._executor.run:
+                self._executor.start(wait=False)
             self._process.start()
-
         grasps_all = []
         for robot_name in self._robot_names:
             # load hand and body
-            scene = GraspitScene(self._process.graspit, robot_name, object_name)
+            scene = GraspitScene(self._process.graspit, robot_name, object_name, self._profiler,
+                                 self._process.robots_dir)
+            self._stats['scene_loads'] += 1
+            round_trips = scene.round_trips
+            round_trips_saved = scene.round_trips_saved
 
-            # plan grasps with a standart procedure
-            plans = scene.planGrasps(max_steps=self._max_steps)
+            # plan grasps with a standart procedure,
+            # speed ratio models share the hand geometry, so they can share plans too
+            if not self._share_plans or robot_name == self._robot_names[0]:
+                plans = []
+                max_steps = self._warm_steps if warm else self._max_steps
+                if not warm or max_steps > 0:
+                    started = time.time()
+                    plans = scene.planGrasps(max_steps=max_steps, **self._plan_args)
+                    self._stats['plan_time'] += time.time() - started
+                    if scene.steps_used is None:
+                        self._stats.pop('plan_steps', None)
+                    elif 'plan_steps' in self._stats:
+                        self._stats['plan_steps'] += scene.steps_used
 
-            # execute grasps with different euristics
-            variants = (
-                dict(approach=False, auto_open=False),  #
-                dict(approach=False, auto_open=True, full_open=True),
-                dict(approach=True, auto_open=True, full_open=False),
-                dict(approach=True, auto_open=True, full_open=True))
+                # previous grasps go first, so new plans duplicating them are dropped
+                plans = warm + plans
+
+                # near-identical plans end up in the same grasps
+                n_plans = len(plans)
+                if self._deduplicator is not None:
+                    plans = self._deduplicator(plans)
+                n_pruned = n_plans - len(plans)
+                self._stats['plans'] += n_plans
+                self._stats['plans_pruned'] += n_pruned
 
-            grasps = []
-            for plan in plans:
-                pose = plan['pose']
-                dofs = plan['dofs']
+                # plans far from the object or penetrating it can't succeed,
+                # previous grasps are in contact already
+                n_rejected = 0
+                if self._prefilter is not None:
+                    seeds = [p for p in plans if p.get('warm')]
+                    new = self._prefilter([p for p in plans if not p.get('warm')],
+                                          os.path.join(self._process.robots_dir, robot_name),
+                                          object_name)
+                    n_rejected = len(plans) - len(seeds) - len(new)
+                    plans = seeds + new
+                    self._stats['plans_rejected'] += n_rejected
+                    self._stats['prefilter_time'] += self._prefilter.stats['time']
 
-                for args in variants:
-                    grasp = scene.grasp(pose, dofs, object_name, **args)
-                    if grasp is not None:
-                        grasps.append(grasp)
+            # execute grasps with different euristics
+            # previous grasps are final hand states, so they are only replayed as is
+            seeds = [p for p in plans if p.get('warm')]
+            new = [p for p in plans if not p.get('warm')]
+            started = time.time()
+            tally = np.zeros((3, len(VARIANTS)))  # tries, successes, quality
+            adaptive = 0 < self._adaptive_variants < len(VARIANTS)
+            # a single batch unless variants are chosen adaptively,
+            # rounds are sized to keep every shard instance busy
+            n_shards = self._executor.n_shards if self._executor is not None else 1
+            round_size = ADAPTIVE_ROUND * n_shards if adaptive else max(len(new), 1)
+            rs = np.random.RandomState(self._seed)
+            states = []
+            for start in range(0, len(new), round_size) or [0]:
+                # seeds go with the first round
+                jobs = [(p['pose'], p['dofs'], VARIANTS[0]) for p in seeds] if start == 0 else []
+                n_seeds, chosen = len(jobs), []
+                for plan in new[start:start + round_size]:
+                    # the first round tries every variant
+                    if adaptive and start > 0:
+                        indices = self._chooseVariants(tally, rs)
+                    else:
+                        indices = list(range(len(VARIANTS)))
+                    jobs += [(plan['pose'], plan['dofs'], VARIANTS[i]) for i in indices]
+                    chosen += indices
+                round_states = self._execute(scene, object_name, jobs)
+                success = np.array([s is not None for s in round_states[n_seeds:]], dtype=bool)
+                succeeded = [s for s in round_states[n_seeds:] if s is not None]
+                quality = arrays_from_states(succeeded)['quality']
+                chosen = np.array(chosen, dtype=int)
+                np.add.at(tally[0], chosen, 1)
+                np.add.at(tally[1], chosen[success], 1)
+                np.add.at(tally[2], chosen[success], quality)
+                states += round_states
+            states = [s for s in states if s is not None]
+            exec_time = time.time() - started
+            n_jobs = len(seeds) + int(tally[0].sum())
 
-            # sort by quality
-            grasps.sort(key=lambda g: g['quality'], reverse=True)
+            self._stats['exec_time'] += exec_time
+            self._stats['simulations'] += n_jobs
+            # every variant is tried without --adaptive_variants, so those tallies are unbiased
+            self._stats['variants'] += [
+                dict(robot=robot_name,
+                     variant=i,
+                     tries=int(tally[0, i]),
+                     successes=int(tally[1, i]),
+                     quality=float(tally[2, i] / max(tally[1, i], 1)))
+                for i in range(len(VARIANTS))
+            ]
+            if plans:
+                self._stats['sim_time_saved'] += exec_time * n_pruned / len(plans)
+            if new:
+                # rejected plans would take as many simulations as kept ones
+                self._stats['sim_time_rejected'] += \
+                    exec_time * n_rejected * tally[0].sum() / len(new) / n_jobs
+
+            # score all grasps at once and sort by quality
+            arrays = arrays_from_states(states)
+            order = np.argsort(-arrays['quality'], kind='mergesort')
 
             # cut best grasps
             if self._max_grasps > 0:
-                grasps = grasps[:self._max_grasps]
+                order = order[:self._max_grasps]
+            arrays = select_grasps(arrays, order)
 
             # GraspIt has a tendency to squeeze the fingers even
             # they aren't in contact with an object.
             # Below we randomize joints positions in such case
             if self._relax_fingers:
-                rs = np.random.RandomState(0)
-                for i, joints in squeezed(grasps):
-                    pose = grasps[i]['pose']
-                    dofs = list(grasps[i]['dofs'])
-                    for attempt in range(20):
-                        angles = rs.uniform(0.0, 2.0, size=len(joints))
-                        for j, a in zip(joints, angles):
-                            dofs[j] = a
-                        grasp = scene.grasp(pose, dofs, object_name)
-                        if grasp is not None:
-                            grasps[i]['dofs'] = tuple(dofs)
+                rs = np.random.RandomState(self._seed)
+                fingers = squeezed_fingers(arrays['dofs'], arrays['link_mask'])
+                relaxed = {}
+                for i in np.flatnonzero(fingers.any(axis=1)):
+                    state = self._relax(scene, arrays['pose'][i], arrays['dofs'][i],
+                                        squeezed_joints(fingers[i]), object_name, rs)
+                    if state is not None:
+                        relaxed[i] = state
+                # relaxed grasps come with their own quality and contacts
+                if relaxed:
+                    states = [relaxed.get(i, states[j]) for i, j in enumerate(order)]
+                    arrays = arrays_from_states(states)
+                    arrays = select_grasps(arrays,
+                                           np.argsort(-arrays['quality'], kind='mergesort'))
 
+            with self._profiler.section('grasps_from_states', object_name, robot_name):
+                grasps = grasps_from_states(object_name, arrays, scene.kinematics)
             grasps_all.extend(grasps)
+            self._stats['round_trips'] += scene.round_trips - round_trips
+            self._stats['round_trips_saved'] += scene.round_trips_saved - round_trips_saved
 
+        if cache_key is not None:
+            self._cache.put(cache_key, grasps_all)
         return (object_name, grasps_all)
+
+    def close(self):
+        """ Stop GraspIt instances of the shard executor """
+        if self._executor is not None:
+            self._executor.join()
+
+    def _execute(self, scene, object_name, jobs):
+        """Execute grasp jobs on the scene or the shard executor
+
+        Arguments:
+            scene {GraspitScene} -- scene
+            object_name {str} -- object
+            jobs {list} -- (pose, dofs, variant) tuples
+
+        Returns:
+            list -- GraspState or None per job
+        """
+        if not jobs:
+            return []
+        if self._executor is not None:
+            states = self._executor.execute(scene.robot, object_name, jobs, compact=True)
+            for name in ['round_trips', 'round_trips_saved', 'scene_loads']:
+                self._stats[name] += self._executor.stats[name]
+            return states
+        return scene.graspBatch(jobs, object_name, compact=True)
+
+    def _chooseVariants(self, tally, rs):
+        """Epsilon-greedy choice of variants to execute a plan with
+
+        Arguments:
+            tally {array} -- (3,V) tries, successes and total quality of variants
+            rs {RandomState} -- random generator
+
+        Returns:
+            list -- variant indices
+        """
+        # mean quality per try, failed tries count as zero quality
+        ranked = list(np.argsort(-tally[2] / np.maximum(tally[0], 1), kind='mergesort'))
+        chosen = []
+        for _ in range(self._adaptive_variants):
+            if rs.uniform() < self._variant_epsilon:
+                rest = [i for i in range(len(VARIANTS)) if i not in chosen]
+                chosen.append(rest[rs.randint(len(rest))])
+            else:
+                chosen.append(next(i for i in ranked if i not in chosen))
+        return chosen
+
+    def _relax(self, scene, pose, dofs, joints, object_name, rs):
+        """Relax squeezed joints of a grasp
+
+        Candidates are simulated most promising first until relax_best_of
+        of them succeed or the simulation budget is spent.
+
+        Arguments:
+            scene {GraspitScene} -- scene
+            pose {array} -- hand pose of the grasp
+            dofs {array} -- hand dofs of the grasp
+            joints {list} -- squeezed joints
+            object_name {str} -- object
+            rs {RandomState} -- random generator
+
+        Returns:
+            GraspState -- best relaxed grasp with the relaxed dofs, or None
+        """
+        dofs = dofs.copy()
+        pose = pose.tolist()
+        candidates = relax_candidates(dofs, joints, 4 * self._relax_budget, rs)
+        best, best_quality, found = None, None, 0
+        for angles in candidates[:self._relax_budget]:
+            dofs[joints] = angles
+            self._stats['relax_sims'] += 1
+            relaxed = scene.graspBatch([(pose, dofs.tolist(), {})], object_name, compact=True)[0]
+            if relaxed is None:
+                continue
+            found += 1
+            quality = arrays_from_states([relaxed])['quality'][0]
+            if best is None or quality > best_quality:
+                # autoGrasp squeezes free fingers again, so the relaxed dofs are kept
+                best, best_quality = relaxed._replace(dofs=dofs.tolist()), quality
+            if found >= self._relax_best_of:
+                break
+        if best is not None:
+            self._stats['relaxed'] += 1
+        return best
@@ -0,0 +1,316 @@
+#!/usr/bin/env python2
+
+import argparse
+import collections
+import glob
+import json
+import os
+
+import numpy as np
+
+from kinematics import LINK_ID, LINK_NAMES
+
+# column -> (dtype, shape of a single row), None stands for the number of hand dofs
+GRASP_COLUMNS = collections.OrderedDict([
+    ('pose', ('<f4', (7,))),
+    ('dofs', ('<f4', (None,))),
+    ('epsilon', ('<f4', ())),
+    ('volume', ('<f4', ())),
+    ('quality', ('<f4', ())),
+    ('mano_trans', ('<f4', (3,))),
+    ('mano_pose', ('<f4', (48,))),
+    ('n_contacts', ('<u2', ())),
+])
+
+CONTACT_COLUMNS = collections.OrderedDict([
+    ('contact_link', ('u1', ())),
+    ('contact_pose', ('<f4', (7,))),
+])
+
+parser = argparse.ArgumentParser(description='Convert JSON grasps to a columnar grasp store')
+parser.add_argument('json_dir', type=str, help="Directory with <body>.json files")
+parser.add_argument('store_dir', type=str, help="Grasp store directory")
+
+
+def arrays_from_grasps(grasps, n_dofs):
+    """Pack grasps to columns
+
+    Arguments:
+        grasps {list} -- grasps as produced by grasp_from_robot_state
+        n_dofs {int} -- number of hand dofs
+
+    Returns:
+        dict -- column arrays, missing MANO parameters are filled with NaN
+    """
+    n = len(grasps)
+    arrays = dict((name, np.zeros((n,) + _shape(shape, n_dofs), dtype))
+                  for name, (dtype, shape) in GRASP_COLUMNS.items())
+    arrays['mano_trans'][:] = np.nan
+    arrays['mano_pose'][:] = np.nan
+    links, poses = [], []
+    for i, grasp in enumerate(grasps):
+        for name in ['pose', 'dofs', 'epsilon', 'volume', 'quality', 'mano_trans', 'mano_pose']:
+            if name in grasp:
+                arrays[name][i] = np.reshape(grasp[name], arrays[name].shape[1:])
+        contacts = grasp['contacts']
+        arrays['n_contacts'][i] = len(contacts)
+        links.extend(LINK_ID[c['link']] for c in contacts)
+        poses.extend(c['pose'] for c in contacts)
+    arrays['contact_link'] = np.array(links, dtype=CONTACT_COLUMNS['contact_link'][0])
+    arrays['contact_pose'] = np.array(poses, dtype=CONTACT_COLUMNS['contact_pose'][0]).reshape(
+        -1, 7)
+    return arrays
+
+
+def grasps_from_arrays(body_name, arrays):
+    """Unpack grasps from columns
+
+    Arguments:
+        body_name {str} -- object name
+        arrays {dict} -- column arrays of the object
+
+    Returns:
+        list -- grasps in the JSON output layout
+    """
+    grasps = []
+    offsets = np.concatenate([[0], np.cumsum(arrays['n_contacts'], dtype=np.int64)])
+    for i in range(len(arrays['pose'])):
+        links = arrays['contact_link'][offsets[i]:offsets[i + 1]]
+        poses = arrays['contact_pose'][offsets[i]:offsets[i + 1]]
+        grasp = dict(
+            body=body_name,
+            pose=arrays['pose'][i].tolist(),
+            dofs=arrays['dofs'][i].tolist(),
+            contacts=[dict(link=LINK_NAMES[l], pose=p.tolist()) for l, p in zip(links, poses)],
+            epsilon=float(arrays['epsilon'][i]),
+            volume=float(arrays['volume'][i]),
+            link_in_contact=[LINK_NAMES[l] for l in np.unique(links)],
+            quality=float(arrays['quality'][i]),
+        )
+        if not np.isnan(arrays['mano_pose'][i]).any():
+            # mano_trans keeps the (1, 3) nesting of Kinematics.getManoPose
+            grasp.update(dict(mano_trans=[arrays['mano_trans'][i].tolist()],
+                              mano_pose=arrays['mano_pose'][i].tolist()))
+        grasps.append(grasp)
+    return grasps
+
+
+def _shape(shape, n_dofs):
+    return tuple(n_dofs if s is None else s for s in shape)
+
+
+def _columns(meta):
+    columns = collections.OrderedDict()
+    for name, (dtype, shape) in list(GRASP_COLUMNS.items()) + list(CONTACT_COLUMNS.items()):
+        columns[name] = (np.dtype(dtype), _shape(shape, meta['n_dofs']))
+    return columns
+
+
+def _readMeta(path):
+    filename = os.path.join(path, 'meta.json')
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
+def _readIndex(path):
+    """Read committed objects, a partially written last line is ignored
+
+    Returns:
+        tuple -- objects index, size of the committed part of objects.jsonl
+    """
+    objects = collections.OrderedDict()
+    size = 0
+    filename = os.path.join(path, 'objects.jsonl')
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                entry = json.loads(line.decode('utf-8'))
+                objects[entry['name']] = entry
+                size += len(line)
+    return objects, size
+
+
+class GraspStoreWriter:
+    """ Writer of a columnar grasp store
+
+    Grasps of all objects are appended to one binary file per column.
+    An object is committed by a line in objects.jsonl written after its
+    columns, so data of an interrupted write is discarded on reopening.
+
+    """
+
+    def __init__(self, path):
+        """Constructor
+
+        Arguments:
+            path {str} -- store directory
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._path = path
+        self._meta = _readMeta(path)
+        self._objects, index_size = _readIndex(path)
+        self._grasps_count = max([o['grasps'][1] for o in self._objects.values()] or [0])
+        self._contacts_count = max([o['contacts'][1] for o in self._objects.values()] or [0])
+
+        # drop uncommitted tails
+        if self._meta is not None:
+            for name, (dtype, shape) in _columns(self._meta).items():
+                rows = self._contacts_count if name in CONTACT_COLUMNS else self._grasps_count
+                filename = self._filename(name)
+                if os.path.isfile(filename):
+                    with open(filename, 'r+b') as f:
+                        f.truncate(rows * dtype.itemsize * int(np.prod(shape)))
+        index_filename = os.path.join(path, 'objects.jsonl')
+        if os.path.isfile(index_filename):
+            with open(index_filename, 'r+b') as f:
+                f.truncate(index_size)
+
+    def _filename(self, column):
+        return os.path.join(self._path, '{}.bin'.format(column))
+
+    def exists(self, body_name):
+        """Check that grasps of the object are already committed"""
+        return body_name in self._objects
+
+    def write(self, body_name, grasps):
+        """Append grasps of the object
+
+        Arguments:
+            body_name {str} -- object name
+            grasps {list} -- object grasps
+        """
+        n_contacts = 0
+        if grasps:
+            if self._meta is None:
+                self._meta = dict(version=1, n_dofs=len(grasps[0]['dofs']), link_names=LINK_NAMES)
+                with open(os.path.join(self._path, 'meta.json'), 'w') as f:
+                    json.dump(self._meta, f)
+
+            arrays = arrays_from_grasps(grasps, self._meta['n_dofs'])
+            for name in _columns(self._meta):
+                with open(self._filename(name), 'ab') as f:
+                    f.write(arrays[name].tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            n_contacts = len(arrays['contact_link'])
+
+        entry = dict(name=body_name,
+                     grasps=[self._grasps_count, self._grasps_count + len(grasps)],
+                     contacts=[self._contacts_count, self._contacts_count + n_contacts])
+        with open(os.path.join(self._path, 'objects.jsonl'), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._objects[body_name] = entry
+        self._grasps_count = entry['grasps'][1]
+        self._contacts_count = entry['contacts'][1]
+
+    def read(self, body_name):
+        """Read grasps of the object
+
+        Arguments:
+            body_name {str} -- object name
+
+        Returns:
+            list -- object grasps
+        """
+        return GraspStore(self._path).grasps(body_name)
+
+    def __repr__(self):
+        return "Grasp store writer: {}".format(self._path)
+
+
+class GraspStore:
+    """ Memory-mapped reader of a columnar grasp store """
+
+    def __init__(self, path):
+        """Constructor
+
+        Arguments:
+            path {str} -- store directory
+        """
+        self._meta = _readMeta(path) or dict(n_dofs=0)
+        self._path = path
+        self._objects, _ = _readIndex(path)
+        grasps_count = max([o['grasps'][1] for o in self._objects.values()] or [0])
+        contacts_count = max([o['contacts'][1] for o in self._objects.values()] or [0])
+
+        self._columns = {}
+        for name, (dtype, shape) in _columns(self._meta).items():
+            rows = contacts_count if name in CONTACT_COLUMNS else grasps_count
+            if rows == 0:
+                self._columns[name] = np.zeros((0,) + shape, dtype)
+            else:
+                self._columns[name] = np.memmap(os.path.join(path, '{}.bin'.format(name)),
+                                                dtype=dtype,
+                                                mode='r',
+                                                shape=(rows,) + shape)
+
+    @property
+    def names(self):
+        """ Names of stored objects """
+        return list(self._objects.keys())
+
+    def __contains__(self, body_name):
+        return body_name in self._objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __getitem__(self, body_name):
+        """Column views of the object
+
+        Arguments:
+            body_name {str} -- object name
+
+        Returns:
+            dict -- zero-copy views of grasp and contact columns
+        """
+        entry = self._objects[body_name]
+        grasps = slice(*entry['grasps'])
+        contacts = slice(*entry['contacts'])
+        return dict((name, column[contacts if name in CONTACT_COLUMNS else grasps])
+                    for name, column in self._columns.items())
+
+    def grasps(self, body_name):
+        """Grasps of the object in the JSON output layout"""
+        return grasps_from_arrays(body_name, self[body_name])
+
+    # reading interface of the writers
+
+    def exists(self, body_name):
+        return body_name in self._objects
+
+    def read(self, body_name):
+        return self.grasps(body_name)
+
+    def __repr__(self):
+        return "Grasp store: {} ({} objects)".format(self._path, len(self))
+
+
+def convert_json(json_dir, store_dir):
+    """Convert <body>.json files to a grasp store, already converted objects are skipped
+
+    Arguments:
+        json_dir {str} -- directory with JSON grasps
+        store_dir {str} -- grasp store directory
+    """
+    writer = GraspStoreWriter(store_dir)
+    for filename in sorted(glob.glob(os.path.join(json_dir, '*.json'))):
+        body_name = os.path.splitext(os.path.basename(filename))[0]
+        if writer.exists(body_name):
+            continue
+        with open(filename) as f:
+            grasps = json.load(f)
+        print('{}: converting {} grasps'.format(body_name, len(grasps)))
+        writer.write(body_name, grasps)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    convert_json(args.json_dir, args.store_dir)
@@ -1,7 +1,36 @@
+import collections
+
 import numpy as np
-from geometry_msgs.msg import Pose
 
-from kinematics import CHAIN_NAME
+try:
+    from geometry_msgs.msg import Pose
+except ImportError:
+    # ROS is not available, e.g. offline benchmarks
+    from sim_commander import Pose
+
+from grasp_store import CONTACT_COLUMNS, grasps_from_arrays
+from kinematics import CHAIN_NAME, LINK_ID
+
+# intermediate and distal joints of index, mid, ring, pinky and thumb fingers
+INTERMEDIATE_JOINTS = [1, 4, 7, 10, 14]
+DISTAL_JOINTS = [2, 5, 8, 11, 15]
+# a finger is squeezed if its distal joint angle + offset exceeds 94 degrees
+DISTAL_OFFSETS = np.array([10.5, 6.5, 8, 2.2, 0])
+# links of a finger which keep it from being squeezed, bitmasks of LINK_ID
+FINGER_LINKS = np.array([
+    sum(1 << LINK_ID[link] for link in links)
+    for links in [['index_link1', 'index_link2'], ['mid_link1', 'mid_link2'],
+                  ['ring_link1', 'ring_link2'], ['pinky_link1', 'pinky_link2'], ['thumb_link2']]
+], dtype=np.uint16)
+PALM_LINK = 1 << LINK_ID['palm']
+
+# grasp as fetched from GraspIt, contacts are link ids and (K,7) poses
+GraspState = collections.namedtuple('GraspState',
+                                    ['pose', 'dofs', 'epsilon', 'volume', 'contact_link',
+                                     'contact_pose'])
+
+# GraspIt body name -> link id
+_body_link_id = {'Base': LINK_ID['palm']}
 
 
 def pose_from_msg(msg):
@@ -34,6 +63,23 @@ def contact_from_msg(msg):
     return dict(link=link, pose=pose)
 
 
+def link_id_from_body(body):
+    """Link id of a GraspIt body, names are parsed once per process
+
+    Arguments:
+        body {str} -- GraspIt body name, e.g. Base or Hand_chain0_link1
+
+    Returns:
+        int -- index in LINK_NAMES
+    """
+    link_id = _body_link_id.get(body)
+    if link_id is None:
+        parts = body.split('_')
+        link_id = LINK_ID[CHAIN_NAME[parts[1]] + '_' + parts[2]]
+        _body_link_id[body] = link_id
+    return link_id
+
+
 def grasp_from_msg(grasp, kinematics=None):
     return dict(pose=pose_from_msg(grasp.pose),
                 dofs=grasp.dofs,
@@ -71,10 +117,164 @@ def grasp_from_robot_state(robot, quality, body_name, kinematics=None):
     return grasp
 
 
+def grasp_state_from_robot(robot, quality, body_name):
+    """Compact grasp of a robot state
+
+    Arguments:
+        robot {Robot} -- GraspIt robot state
+        quality {ComputeQuality} -- GraspIt quality response
+        body_name {str} -- grasped body
+
+    Returns:
+        GraspState -- grasp with contacts in contact with the body only
+    """
+    contacts = [c for c in robot.contacts if c.body2 == body_name]
+    return GraspState(pose=pose_from_msg(robot.pose),
+                      dofs=robot.dofs,
+                      epsilon=quality.epsilon,
+                      volume=quality.volume,
+                      contact_link=np.array([link_id_from_body(c.body1) for c in contacts],
+                                            dtype=np.uint8),
+                      contact_pose=np.array([pose_from_msg(c.ps.pose) for c in contacts],
+                                            dtype=np.float64).reshape(-1, 7))
+
+
+def arrays_from_states(states):
+    """Pack grasps to columns and score them
+
+    Columns follow the grasp store layout with float64 precision, plus
+    a link_mask column with a bit per link in contact.
+
+    Arguments:
+        states {list} -- GraspState grasps
+
+    Returns:
+        dict -- column arrays, MANO parameters are NaN
+    """
+    n = len(states)
+    n_dofs = len(states[0].dofs) if states else 0
+    arrays = dict(
+        pose=np.array([s.pose for s in states], dtype=np.float64).reshape(n, 7),
+        dofs=np.array([s.dofs for s in states], dtype=np.float64).reshape(n, n_dofs),
+        epsilon=np.array([s.epsilon for s in states], dtype=np.float64),
+        volume=np.array([s.volume for s in states], dtype=np.float64),
+        mano_trans=np.full((n, 3), np.nan),
+        mano_pose=np.full((n, 48), np.nan),
+        n_contacts=np.array([len(s.contact_link) for s in states], dtype=np.uint16),
+        contact_link=np.concatenate([np.zeros(0, np.uint8)] + [s.contact_link for s in states]),
+        contact_pose=np.concatenate([np.zeros((0, 7))] + [s.contact_pose for s in states]))
+    arrays['link_mask'] = link_masks(arrays['contact_link'], arrays['n_contacts'])
+    arrays['quality'] = grasp_qualities(arrays['epsilon'], arrays['volume'], arrays['link_mask'])
+    return arrays
+
+
+def select_grasps(arrays, index):
+    """Subset of packed grasps
+
+    Arguments:
+        arrays {dict} -- column arrays as returned by arrays_from_states
+        index {array} -- indices of the grasps to keep, in the output order
+
+    Returns:
+        dict -- column arrays of the selected grasps
+    """
+    index = np.asarray(index, dtype=np.int64)
+    counts = arrays['n_contacts'].astype(np.int64)
+    starts = np.cumsum(counts) - counts
+    counts, starts = counts[index], starts[index]
+    contacts = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return dict((name, column[contacts] if name in CONTACT_COLUMNS else column[index])
+                for name, column in arrays.items())
+
+
+def grasps_from_states(body_name, arrays, kinematics=None):
+    """Grasps in the JSON output layout
+
+    Arguments:
+        body_name {str} -- object name
+        arrays {dict} -- column arrays as returned by arrays_from_states
+
+    Keyword Arguments:
+        kinematics {Kinematics} -- add MANO parameters, computed in a batch (default: {None})
+
+    Returns:
+        list -- grasps dicts
+    """
+    if kinematics is not None and len(arrays['pose']):
+        trans, pose = kinematics.getManoPoses(arrays['pose'][:, :3], arrays['pose'][:, 3:],
+                                              arrays['dofs'])
+        arrays = dict(arrays, mano_trans=trans, mano_pose=pose)
+    return grasps_from_arrays(body_name, arrays)
+
+
+def grasp_from_state(state, body_name, kinematics=None):
+    """Single grasp in the JSON output layout, see grasps_from_states"""
+    return grasps_from_states(body_name, arrays_from_states([state]), kinematics)[0]
+
+
+def link_masks(contact_link, n_contacts):
+    """Links in contact of grasps
+
+    Arguments:
+        contact_link {array} -- link ids of all contacts
+        n_contacts {array} -- number of contacts per grasp
+
+    Returns:
+        array -- bitmask of link ids per grasp
+    """
+    masks = np.zeros(len(n_contacts), dtype=np.uint16)
+    grasp_index = np.repeat(np.arange(len(n_contacts)), n_contacts.astype(np.int64))
+    np.bitwise_or.at(masks, grasp_index, np.left_shift(1, contact_link.astype(np.uint16)))
+    return masks
+
+
+def grasp_qualities(epsilon, volume, link_mask):
+    """Quality of grasps, vectorized grasp_from_robot_state score
+
+    Arguments:
+        epsilon {array} -- epsilon qualities
+        volume {array} -- volume qualities
+        link_mask {array} -- links in contact, see link_masks
+
+    Returns:
+        array -- qualities
+    """
+    n_links = np.unpackbits(link_mask.astype('<u2').view(np.uint8).reshape(-1, 2), axis=1).sum(1)
+    palm = (link_mask & PALM_LINK) != 0
+    return np.hypot(epsilon, volume) * np.where(palm, 3.0, 1.0) * np.sqrt(n_links)
+
+
+def squeezed_fingers(dofs, link_mask):
+    """Fingers squeezed without touching the object, vectorized squeezed
+
+    Arguments:
+        dofs {array} -- (N,20) hand dofs angles
+        link_mask {array} -- links in contact, see link_masks
+
+    Returns:
+        array -- (N,5) mask of index, mid, ring, pinky and thumb fingers
+    """
+    squeezed = np.degrees(dofs[:, DISTAL_JOINTS]) + DISTAL_OFFSETS > 94
+    return squeezed & ((link_mask[:, None] & FINGER_LINKS) == 0)
+
+
+def squeezed_joints(fingers):
+    """Joints to relax of squeezed fingers
+
+    Arguments:
+        fingers {array} -- finger mask, a row of squeezed_fingers
+
+    Returns:
+        list -- intermediate joints followed by distal joints, as squeezed()
+    """
+    index = np.flatnonzero(fingers)
+    return [INTERMEDIATE_JOINTS[i] for i in index] + [DISTAL_JOINTS[i] for i in index]
+
+
 def squeezed(grasps):
-    intermadiates = [1, 4, 7, 10, 14]
-    distals = [2, 5, 8, 11, 15]
-    offsets = np.array([10.5, 6.5, 8, 2.2, 0])
+    intermadiates = INTERMEDIATE_JOINTS
+    distals = DISTAL_JOINTS
+    offsets = DISTAL_OFFSETS
     dependent = [
         set(['index_link1', 'index_link2']),
         set(['mid_link1', 'mid_link2']),
@@ -91,8 +291,32 @@ def squeezed(grasps):
         no_touch = [not (l & link_in_contact) for l in dependent]
         indicies = np.logical_and(squeezed, no_touch)
 
-        joints = [intermadiates[i] for i, cond in enumerate(indicies) if cond] + \
-            [distals[i] for i, cond in enumerate(indicies) if cond]
+        # k, not i: python2 list comprehensions leak their variable
+        joints = [intermadiates[k] for k, cond in enumerate(indicies) if cond] + \
+            [distals[k] for k, cond in enumerate(indicies) if cond]
 
         if joints:
             yield i, joints
+
+
+def relax_candidates(dofs, joints, n, rs):
+    """Random angles of squeezed joints, most promising first
+
+    Candidates which leave a finger squeezed are dropped, the rest are
+    ordered by distance to the current angles.
+
+    Arguments:
+        dofs {list} -- hand dofs angles
+        joints {list} -- squeezed joints as returned by squeezed()
+        n {int} -- number of random candidates
+        rs {RandomState} -- random generator
+
+    Returns:
+        array -- (K,len(joints)) candidate angles, K <= n
+    """
+    angles = rs.uniform(0.0, 2.0, size=(n, len(joints)))
+    offsets = dict(zip(DISTAL_JOINTS, DISTAL_OFFSETS))
+    limits = np.array([94 - offsets[j] if j in offsets else np.inf for j in joints])
+    candidates = angles[np.all(np.degrees(angles) <= limits, axis=1)]
+    distance = np.linalg.norm(candidates - np.asarray(dofs)[joints], axis=1)
+    return candidates[np.argsort(distance, kind='mergesort')]
@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+
+from grasp_store import GraspStore
+
+
+class GraspWriter:
+    """ Writer of per object grasps files
+
+    Grasps of each object are written to <path>/<body>.json as soon as
+    the object is mined. Files are replaced atomically, so an existing
+    file is always complete.
+
+    """
+
+    def __init__(self, path):
+        """Constructor
+
+        Arguments:
+            path {str} -- output directory
+        """
+        self._path = path
+
+    @property
+    def names(self):
+        """ Names of objects with written grasps """
+        return sorted(
+            os.path.splitext(name)[0] for name in os.listdir(self._path)
+            if name.endswith('.json') and not name.startswith('.'))
+
+    def filename(self, body_name):
+        """ Path to the object grasps file """
+        return os.path.join(self._path, '{}.json'.format(body_name))
+
+    def exists(self, body_name):
+        """Check that complete grasps of the object are already written
+
+        Arguments:
+            body_name {str} -- object name
+
+        Returns:
+            bool -- output exists and is complete
+        """
+        try:
+            with open(self.filename(body_name), 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 16))
+                tail = f.read()
+        except (IOError, OSError):
+            return False
+        # files left by an interrupted non-atomic write are truncated
+        return tail.rstrip().endswith(b']')
+
+    def write(self, body_name, grasps):
+        """Atomically write grasps of the object
+
+        Arguments:
+            body_name {str} -- object name
+            grasps {list} -- object grasps
+
+        Returns:
+            list -- (offset, length) byte range of each grasp in the file
+        """
+        fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(body_name),
+                                        suffix='.tmp',
+                                        dir=self._path)
+        try:
+            # same bytes as json.dump of the list, with grasps positions tracked
+            ranges, offset = [], 1
+            with os.fdopen(fd, 'w') as f:
+                f.write('[')
+                for i, grasp in enumerate(grasps):
+                    data = json.dumps(grasp)
+                    if i > 0:
+                        f.write(', ')
+                        offset += 2
+                    f.write(data)
+                    ranges.append((offset, len(data)))
+                    offset += len(data)
+                f.write(']')
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.filename(body_name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return ranges
+
+    def readAt(self, body_name, ranges):
+        """Read single grasps of the object
+
+        Arguments:
+            body_name {str} -- object name
+            ranges {list} -- (offset, length) byte ranges as returned by write
+
+        Returns:
+            list -- grasps
+        """
+        grasps = []
+        with open(self.filename(body_name), 'rb') as f:
+            for offset, length in ranges:
+                f.seek(offset)
+                grasps.append(json.loads(f.read(length).decode('utf-8')))
+        return grasps
+
+    def read(self, body_name):
+        """Read grasps of the object
+
+        Arguments:
+            body_name {str} -- object name
+
+        Returns:
+            list -- object grasps
+        """
+        with open(self.filename(body_name)) as f:
+            return json.load(f)
+
+    def __repr__(self):
+        return "Grasp writer: {}".format(self._path)
+
+
+def open_reader(path):
+    """Reader of mined grasps
+
+    Arguments:
+        path {str} -- directory with <body>.json files or a grasp store
+
+    Returns:
+        GraspWriter or GraspStore -- reader with names, exists() and read()
+    """
+    if os.path.isfile(os.path.join(path, 'meta.json')):
+        return GraspStore(path)
+    return GraspWriter(path)
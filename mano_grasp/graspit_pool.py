@@ -0,0 +1,258 @@
+import multiprocessing
+import os
+import time
+import traceback
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from graspit_process import GraspitProcess
+
+
+def _worker(index, task_factory, process_class, process_args, tasks, results, parent):
+    """Worker loop: start a GraspIt instance once and serve tasks until a stop signal
+
+    The worker also stops once its parent process is gone.
+    """
+    process = process_class(**process_args)
+    started = time.time()
+    try:
+        process.start()
+    except Exception:
+        results.put(('failed', index, traceback.format_exc()))
+        return
+    results.put(('ready', index, time.time() - started, getattr(process, 'start_attempts', 1)))
+
+    task = None
+    try:
+        task = task_factory(process)
+        while True:
+            try:
+                name = tasks.get(timeout=1.0)
+            except Empty:
+                if os.getppid() != parent:
+                    break
+                continue
+            if name is None:
+                break
+            results.put(('start', index, name))
+            started = time.time()
+            try:
+                result, error = task(name), None
+            except Exception:
+                result, error = None, traceback.format_exc()
+            stats = dict(getattr(task, 'stats', {}), worker=index, elapsed=time.time() - started)
+            profiler = getattr(task, 'profiler', None)
+            if profiler is not None and profiler.enabled:
+                stats['profile'] = profiler.pop()
+            results.put(('done', index, name, result, error, stats))
+    finally:
+        if hasattr(task, 'close'):
+            task.close()
+        process.join()
+
+
+class GraspitPool:
+    """ Pool of warm GraspIt instances
+
+    Each worker process starts its own GraspIt instance once and keeps it
+    running while pulling object names from a shared queue. Any picklable
+    item can be used in place of an object name.
+
+    """
+
+    def __init__(self, task_factory, n_workers=1, process_class=GraspitProcess, **process_args):
+        """Constructor
+
+        Arguments:
+            task_factory {callable} -- creates a task from a started GraspitProcess,
+                the task maps an object name to a result (e.g. GraspMiner)
+
+        Keyword Arguments:
+            n_workers {int} -- number of GraspIt instances (default: {1})
+            process_class {type} -- GraspIt process wrapper (default: {GraspitProcess})
+            process_args -- GraspitProcess constructor arguments
+        """
+        self._task_factory = task_factory
+        self._n_workers = n_workers
+        self._process_class = process_class
+        self._process_args = process_args
+        self._workers = []
+        self._tasks = None
+        self._results = None
+        self._stats = []
+        self._alive = set()
+        self._starting = set()
+        self._running = {}
+
+    def start(self, wait=True):
+        """Start all GraspIt instances in parallel
+
+        Keyword Arguments:
+            wait {bool} -- wait until the instances are ready, otherwise call
+                wait() later (default: {True})
+        """
+        assert not self._workers
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._stats = [
+            dict(worker=i, startup=None, attempts=0, ready=None, objects=0, busy=0.0, failed=0)
+            for i in range(self._n_workers)
+        ]
+        for i in range(self._n_workers):
+            worker = multiprocessing.Process(target=_worker,
+                                             args=(i, self._task_factory, self._process_class,
+                                                   self._process_args, self._tasks,
+                                                   self._results, os.getpid()))
+            # not a daemon, so a task can run a pool of its own
+            worker.daemon = False
+            worker.start()
+            self._workers.append(worker)
+        self._starting = set(range(self._n_workers))
+        if wait:
+            self.wait()
+
+    def wait(self):
+        """Wait until all started instances are ready or failed to start"""
+        while self._starting:
+            try:
+                message = self._results.get(timeout=1.0)
+            except Empty:
+                for index in list(self._starting):
+                    if not self._workers[index].is_alive():
+                        print('GraspIt worker {} died while starting'.format(index))
+                        self._starting.discard(index)
+                continue
+            index = message[1]
+            if message[0] == 'ready':
+                self._stats[index]['startup'] = message[2]
+                self._stats[index]['attempts'] = message[3]
+                self._stats[index]['ready'] = time.time()
+                self._alive.add(index)
+            else:
+                print('GraspIt worker {} failed to start:\n{}'.format(index, message[2]))
+            self._starting.discard(index)
+
+        if not self._alive:
+            self.join()
+            raise Exception('Cannot start any GraspIt instance')
+
+    def imap(self, names, on_error=None):
+        """Process objects on the pool
+
+        Objects are fed lazily, one per idle worker, and results are
+        yielded in completion order. Failed objects are reported and skipped.
+        A None name means nothing to feed yet, names are requested again
+        after the next result or within a second.
+
+        Arguments:
+            names {iterable} -- object names
+
+        Keyword Arguments:
+            on_error {callable} -- called with the name of a failed object (default: {None})
+
+        Yields:
+            tuple -- task result, task statistics
+        """
+        self.wait()
+        names = iter(names)
+        in_flight = 0
+        exhausted = False
+        while True:
+            while not exhausted and in_flight < len(self._alive):
+                try:
+                    name = next(names)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if name is None:
+                    break
+                self._tasks.put(name)
+                in_flight += 1
+            if in_flight == 0:
+                if exhausted:
+                    break
+                time.sleep(1.0)
+                continue
+
+            try:
+                message = self._results.get(timeout=1.0)
+            except Empty:
+                lost = self._checkWorkers()
+                in_flight -= len(lost)
+                if on_error is not None:
+                    for name in lost:
+                        on_error(name)
+                continue
+
+            index = message[1]
+            if message[0] == 'start':
+                self._running[index] = message[2]
+            elif message[0] == 'done':
+                _, _, name, result, error, task_stats = message
+                self._running.pop(index, None)
+                stats = self._stats[index]
+                stats['busy'] += task_stats['elapsed']
+                in_flight -= 1
+                if error is None:
+                    stats['objects'] += 1
+                    yield result, task_stats
+                else:
+                    stats['failed'] += 1
+                    print('{}: failed on worker {}\n{}'.format(name, index, error))
+                    if on_error is not None:
+                        on_error(name)
+
+    def _checkWorkers(self):
+        """Forget dead workers, return the tasks lost with them"""
+        lost = []
+        for index in list(self._alive):
+            if not self._workers[index].is_alive():
+                self._alive.discard(index)
+                name = self._running.pop(index, None)
+                if name is not None:
+                    lost.append(name)
+                    self._stats[index]['failed'] += 1
+                    print('{}: worker {} died'.format(name, index))
+        if not self._alive:
+            raise Exception('All GraspIt workers died')
+        return lost
+
+    def utilization(self):
+        """Per-instance utilization
+
+        Returns:
+            list -- dicts with startup time, processed objects, busy time and
+                busy fraction since the instance became ready
+        """
+        now = time.time()
+        utilization = []
+        for stats in self._stats:
+            stats = dict(stats)
+            wall = now - stats.pop('ready') if stats['ready'] is not None else 0.0
+            stats['utilization'] = stats['busy'] / wall if wall > 0 else 0.0
+            utilization.append(stats)
+        return utilization
+
+    def join(self, timeout=30.0):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self._alive = set()
+        self._starting = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.join()
+
+    def __repr__(self):
+        return "GraspIt pool: {} workers".format(self._n_workers)
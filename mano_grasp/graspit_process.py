@@ -1,11 +1,10 @@
+import collections
 import numpy as np
 import os
 import subprocess
+import time
 import uuid
-from threading import Timer
-
-import rospy
-from rospy.exceptions import ROSException
+from threading import Thread, Timer
 
 
 class GraspitProcess:
@@ -21,7 +20,11 @@ class GraspitProcess:
                  plugin_dir='',
                  headless=False,
                  xvfb_run=False,
-                 verbose=False):
+                 display='',
+                 verbose=False,
+                 start_timeout=15.0,
+                 start_retries=2,
+                 start_backoff=1.0):
         """Constructor
         
         Keyword Arguments:
@@ -29,13 +32,26 @@ class GraspitProcess:
             plugin_dir {str} -- path to directory with a graspit_interface plugin  (default: {auto})
             headless {bool} -- start GraspIt in headless mode (default: {False})
             xvfb_run {bool} -- use Xserver Virtual Frame Buffer (Xvfb) (default: {False})
+            display {str} -- X display to use instead of xvfb-run, e.g. of a shared
+                XvfbServer (default: {inherited})
             verbose  {bool} -- echoing GraspIt output to console (default: {False})
+            start_timeout {float} -- max time to wait for a graspit node, seconds (default: {15.0})
+            start_retries {int} -- restarts of an instance which failed to start (default: {2})
+            start_backoff {float} -- delay before the first restart, doubled after each
+                restart, seconds (default: {1.0})
         """
         self._graspit_dir = graspit_dir or os.environ['GRASPIT']
         self._plugin_dir = plugin_dir or os.environ['GRASPIT_PLUGIN_DIR']
-        self._headless = headless or xvfb_run
-        self._xvfb_run = xvfb_run
+        self._headless = headless or xvfb_run or bool(display)
+        self._xvfb_run = xvfb_run and not display
+        self._display = display
         self._verbose = verbose
+        self._start_timeout = start_timeout
+        self._start_retries = start_retries
+        self._start_backoff = start_backoff
+        self._startup_time = None
+        self._start_attempts = 0
+        self._log = None
         self._run = False
         self._uid = None
         self._proc = None
@@ -52,22 +68,50 @@ class GraspitProcess:
         """ Path to GraspIt root directory """
         return self._graspit_dir
 
+    @property
+    def robots_dir(self):
+        """ Path to GraspIt robots directory """
+        return os.path.join(self._graspit_dir, 'models', 'robots')
+
+    @property
+    def startup_time(self):
+        """ Time to start the instance including restarts, seconds """
+        return self._startup_time
+
+    @property
+    def start_attempts(self):
+        """ Number of attempts to start the instance """
+        return self._start_attempts
+
     def _startProcess(self):
         uid = uuid.uuid1().hex
         graspit_node_name = 'graspit_{}'.format(uid)
         devnull = open(os.devnull, 'wb')
 
+        env = None
+        if self._display:
+            env = dict(os.environ, DISPLAY=self._display)
+
         proc = subprocess.Popen(
             # yapf: disable
-            [
-                '{}graspit_simulator'.format('xvfb-run ' if self._xvfb_run else ''), '-p',
+            (['xvfb-run', '-a'] if self._xvfb_run else []) + [
+                'graspit_simulator', '-p',
                 'libgraspit_interface', '--node_name', graspit_node_name,
                 '__name:={}'.format(graspit_node_name), '--headless' if self._headless else ''
             ],
             # yapf: enable
             shell=False,
+            env=env,
             stdout=None if self._verbose else devnull,
-            stderr=None if self._verbose else devnull)
+            stderr=None if self._verbose else subprocess.PIPE)
+
+        # keep the last lines of error output to report why an instance failed to start
+        self._log = None
+        if not self._verbose:
+            self._log = collections.deque(maxlen=20)
+            reader = Thread(target=self._log.extend, args=(iter(proc.stderr.readline, b''),))
+            reader.daemon = True
+            reader.start()
 
         self._proc = proc
         self._uid = uid
@@ -76,33 +120,71 @@ class GraspitProcess:
     def _setupCommander(self):
         uid = self._uid
         commander_node_name = 'GraspItCommanderNode_{}'.format(uid)
+        import rospy
+        from rospy.exceptions import ROSException
         from graspit_commander import GraspitCommander
         GraspitCommander.ROS_NODE_NAME = commander_node_name
         GraspitCommander.GRASPIT_NODE_NAME = '/' + self._node_name + '/'
-        try:
-            rospy.wait_for_service('/' + self._node_name + '/clearWorld', timeout=15.0)
-        except ROSException, e:
+        service = '/' + self._node_name + '/clearWorld'
+        started = time.time()
+        while True:
+            # fail as soon as the simulator exits instead of waiting for the timeout
             retcode = self._proc.poll()
-            raise Exception('Cannot connect to a graspit node, process retcode: ', retcode)
+            if retcode is not None:
+                raise Exception('GraspIt process exited with retcode {}{}'.format(
+                    retcode, self._logTail()))
+            try:
+                rospy.wait_for_service(service, timeout=0.2)
+                break
+            except ROSException:
+                if time.time() - started > self._start_timeout:
+                    raise Exception('Cannot connect to a graspit node in {:.0f} s{}'.format(
+                        self._start_timeout, self._logTail()))
         self._commander = GraspitCommander
 
     @property
     def run(self):
         return self._run
 
+    def _logTail(self):
+        if not self._log:
+            return ''
+        return ', output:\n' + b''.join(self._log).decode('utf-8', 'replace').strip()
+
     def start(self):
+        """Start the instance, restart it with a growing delay if it fails to start"""
         assert self._run == False
-        self._startProcess()
-        self._setupCommander()
+        started = time.time()
+        self._start_attempts = 0
+        while True:
+            self._start_attempts += 1
+            try:
+                self._startProcess()
+                self._setupCommander()
+                break
+            except ImportError:
+                self.join()
+                raise
+            except Exception as e:
+                self.join()
+                if self._start_attempts > self._start_retries:
+                    raise
+                delay = self._start_backoff * 2**(self._start_attempts - 1)
+                print('GraspIt start attempt {} failed, retry in {:.1f} s: {}'.format(
+                    self._start_attempts, delay, e))
+                time.sleep(delay)
+        self._startup_time = time.time() - started
         self._run = True
 
     def join(self, timeout=5.0):
+        if self._proc is not None and self._proc.poll() is not None:
+            self._proc = None  # already exited
         if self._proc is not None:
             self._proc.terminate()
             timer = Timer(timeout, self._proc.kill)
             try:
                 timer.start()
-                self._proc.communicate()
+                self._proc.wait()
             finally:
                 timer.cancel()
                 self._proc = None
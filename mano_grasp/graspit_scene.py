@@ -1,39 +1,134 @@
 import os
-from geometry_msgs.msg import Pose
+import time
 
-from kinematics import Kinematics
+from kinematics import load_kinematics
 from grasp_utils import *
+from plan_filter import PlanDeduplicator
+from profiler import Profiler
+
+
+DEFAULT_POSE = [0, 0.2, 0, 0, 0, 0, 1]
 
 
 class GraspitScene:
     """ Scene with a hand (robot) and a body """
 
-    def __init__(self, graspit, robot, body):
-        default_pose = Pose()
-        default_pose.position.y = 0.2
-        default_pose.orientation.w = 1
+    def __init__(self, graspit, robot, body, profiler=None, robots_dir=None):
+        """Constructor
+
+        Arguments:
+            graspit {GraspitCommander} -- commander of a GraspIt instance
+            robot {str} -- robot name
+            body {str} -- graspable body name
+
+        Keyword Arguments:
+            profiler {Profiler} -- record GraspIt calls and grasp conversions (default: {None})
+            robots_dir {str} -- path to GraspIt robots directory (default: {auto})
+        """
+        self._profiler = profiler or Profiler(enabled=False)
+        graspit = self._profiler.wrap(graspit, body, robot)
 
         graspit.clearWorld()
         graspit.importRobot(robot)
-        graspit.setRobotPose(default_pose)
+        graspit.setRobotPose(msg_from_pose(DEFAULT_POSE))
         graspit.importGraspableBody(body)
 
         self._graspit = graspit
         self._robot = robot
         self._body = body
-        self._kinematics = Kinematics('{}/models/robots/{}'.format(os.environ['GRASPIT'], robot))
+        robots_dir = robots_dir or os.path.join(os.environ['GRASPIT'], 'models', 'robots')
+        self._kinematics = self._profiler.wrap(load_kinematics(os.path.join(robots_dir, robot)),
+                                               body, robot)
+        self._collisions = None
+        self._steps_used = 0
+        self._round_trips = 0
+        self._round_trips_saved = 0
 
-    def planGrasps(self, max_steps=70000):
+    @property
+    def robot(self):
+        return self._robot
+
+    @property
+    def body(self):
+        return self._body
+
+    @property
+    def kinematics(self):
+        """ GraspIt -> MANO converter of the robot """
+        return self._kinematics
+
+    def reset(self):
+        """Move the hand back to its initial pose"""
+        self._toggleAllCollisions(False)
+        self._call('setRobotPose', msg_from_pose(DEFAULT_POSE))
+
+    def planGrasps(self,
+                   max_steps=70000,
+                   increment=0,
+                   top_k=10,
+                   tolerance=0.01,
+                   patience=2,
+                   max_time=0):
         """Plan grasps
-        
+
+        With a non-zero increment the planner runs in chunks of increment
+        steps and stops early once neither the mean epsilon quality of the
+        top_k plans nor the number of distinct plans among them improves by
+        more than tolerance for patience chunks in a row. Every chunk is a
+        planGrasps call which restarts the simulated annealing search, so
+        this is a series of short independent searches, not one search
+        stopped early.
+
         Keyword Arguments:
             max_steps {int} -- planner max steps (default: {70000})
-        
+            increment {int} -- planner steps per chunk, 0 plans at once (default: {0})
+            top_k {int} -- number of best plans to track (default: {10})
+            tolerance {float} -- relative improvement threshold (default: {0.01})
+            patience {int} -- chunks without improvement before stopping (default: {2})
+            max_time {float} -- planning time limit, seconds, 0 is unlimited (default: {0})
+
         Returns:
             list -- list of planned grasps
         """
-        result = self._graspit.planGrasps(max_steps=max_steps)
-        return [grasp_from_msg(g) for g in result.grasps]
+        if max_steps is None:
+            max_steps = 70000
+        if increment <= 0:
+            result = self._graspit.planGrasps(max_steps=max_steps)
+            # 0 leaves the budget to GraspIt, which does not report the steps it took
+            self._steps_used = max_steps or None
+            return [grasp_from_msg(g) for g in result.grasps]
+
+        # chunks need a step budget, 0 leaves it to GraspIt in a single search
+        max_steps = max_steps or 70000
+        deduplicator = PlanDeduplicator()
+        started = time.time()
+        plans, steps, stale = [], 0, 0
+        best_quality, best_distinct = None, 0
+        while steps < max_steps:
+            n = min(increment, max_steps - steps)
+            result = self._graspit.planGrasps(max_steps=n)
+            steps += n
+            plans.extend(grasp_from_msg(g) for g in result.grasps)
+
+            top = sorted(plans, key=lambda p: p['epsilon'], reverse=True)[:top_k]
+            quality = np.mean([p['epsilon'] for p in top] or [0])
+            distinct = len(deduplicator(top))
+            if best_quality is None or quality > best_quality + tolerance * abs(best_quality) \
+                    or distinct > best_distinct * (1.0 + tolerance):
+                stale = 0
+            else:
+                stale += 1
+            best_quality = quality if best_quality is None else max(best_quality, quality)
+            best_distinct = max(best_distinct, distinct)
+            if stale >= patience or (max_time > 0 and time.time() - started >= max_time):
+                break
+        self._steps_used = steps
+        return plans
+
+    @property
+    def steps_used(self):
+        """ Planner steps used by the last planGrasps call, None if GraspIt chose the budget """
+        return self._steps_used
 
     def grasp(self, pose, dofs, body='', approach=False, auto_open=False, full_open=False):
         """Execute a grasp
@@ -49,29 +144,145 @@ class GraspitScene:
         Returns:
             dict -- grasp data
         """
-        graspit = self._graspit
-        kinematics = self._kinematics
+        variant = dict(approach=approach, auto_open=auto_open, full_open=full_open)
+        return self.graspBatch([(pose, dofs, variant)], body)[0]
+
+    def graspBatch(self, jobs, body='', compact=False):
+        """Execute a batch of grasps with a minimal number of GraspIt calls
+
+        Collisions are toggled only when their state changes.
+
+        Arguments:
+            jobs {list} -- (pose, dofs, variant) tuples, variant is a dict
+                of grasp keyword arguments (approach, auto_open, full_open)
+
+        Keyword Arguments:
+            body {str} -- grasping body name (default: {''})
+            compact {bool} -- return GraspState grasps, to be scored and converted
+                in a batch with arrays_from_states (default: {False})
+
+        Returns:
+            list -- grasp data or None for each job
+        """
+        results = []
+        for pose, dofs, variant in jobs:
+            state = self._execute(pose, dofs, body, **variant)
+            if state is None or compact:
+                results.append(state)
+            else:
+                with self._profiler.section('grasp_from_state', self._body, self._robot):
+                    results.append(grasp_from_state(state, body, self._kinematics))
+        return results
+
+    @property
+    def round_trips(self):
+        """ GraspIt calls made by grasps executed in this scene """
+        return self._round_trips
+
+    @property
+    def round_trips_saved(self):
+        """ Collision toggles skipped as the collisions state did not change """
+        return self._round_trips_saved
+
+    def _call(self, name, *args):
+        self._round_trips += 1
+        return getattr(self._graspit, name)(*args)
+
+    def _toggleAllCollisions(self, enable):
+        if self._collisions == enable:
+            self._round_trips_saved += 1
+            return
+        self._collisions = None
+        self._call('toggleAllCollisions', enable)
+        self._collisions = enable
+
+    def _execute(self, pose, dofs, body, approach=False, auto_open=False, full_open=False):
         try:
             # execute grasp
-            graspit.toggleAllCollisions(False)
-            graspit.setRobotPose(msg_from_pose(pose))
-            graspit.forceRobotDof(dofs)
+            self._toggleAllCollisions(False)
+            self._call('setRobotPose', msg_from_pose(pose))
+            self._call('forceRobotDof', dofs)
             if auto_open:
                 if not full_open:
-                    graspit.toggleAllCollisions(True)
-                graspit.autoOpen()
-            graspit.toggleAllCollisions(True)
+                    self._toggleAllCollisions(True)
+                self._call('autoOpen')
+            self._toggleAllCollisions(True)
             if approach:
-                graspit.approachToContact()
-            graspit.autoGrasp()
+                self._call('approachToContact')
+            self._call('autoGrasp')
             # compute quality
-            quality = graspit.computeQuality()
+            quality = self._call('computeQuality')
             if quality.result == 0 and quality.epsilon > -1:
-                response = graspit.getRobot()
+                response = self._call('getRobot')
                 robot = response.robot
-                return grasp_from_robot_state(robot, quality, body, kinematics)
+                with self._profiler.section('grasp_state_from_robot', self._body, self._robot):
+                    return grasp_state_from_robot(robot, quality, body)
         except Exception:
             pass
 
     def __repr__(self):
-        return "Scene {} -> {}".format(self._robot, self._body)
\ No newline at end of file
+        return "Scene {} -> {}".format(self._robot, self._body)
+
+
+class SceneManager:
+    """ Keeps a GraspIt world loaded between scenes
+
+    A scene with the same robot and body as the loaded one is reused
+    with the hand moved back to its initial pose, otherwise the world
+    is cleared and reloaded. graspit_interface has no call to remove a
+    single robot or body, so swapping only one of them is a reload too.
+    Reuse only pays off where the same scene is requested repeatedly,
+    e.g. by shard instances executing chunks of one object.
+
+    """
+
+    def __init__(self, graspit, profiler=None, robots_dir=None):
+        """Constructor
+
+        Arguments:
+            graspit {GraspitCommander} -- commander of a GraspIt instance
+
+        Keyword Arguments:
+            profiler {Profiler} -- record GraspIt calls and grasp conversions (default: {None})
+            robots_dir {str} -- path to GraspIt robots directory (default: {auto})
+        """
+        self._graspit = graspit
+        self._profiler = profiler
+        self._robots_dir = robots_dir
+        self._scene = None
+        self._loads = 0
+        self._reuses = 0
+
+    @property
+    def loads(self):
+        """ Number of world reloads """
+        return self._loads
+
+    @property
+    def reuses(self):
+        """ Number of scenes served without reloading """
+        return self._reuses
+
+    def scene(self, robot, body):
+        """Scene with the robot and the body
+
+        Arguments:
+            robot {str} -- robot name
+            body {str} -- graspable body name
+
+        Returns:
+            GraspitScene -- loaded scene
+        """
+        scene = self._scene
+        if scene is not None and scene.robot == robot and scene.body == body:
+            self._reuses += 1
+            scene.reset()
+            return scene
+        # do not keep a stale scene if loading fails
+        self._scene = None
+        self._scene = GraspitScene(self._graspit, robot, body, self._profiler, self._robots_dir)
+        self._loads += 1
+        return self._scene
+
+    def __repr__(self):
+        return "Scene manager: {} loads, {} reuses".format(self._loads, self._reuses)
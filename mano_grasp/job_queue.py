@@ -0,0 +1,281 @@
+#!/usr/bin/env python2
+
+import argparse
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+try:
+    from urllib import quote, unquote
+except ImportError:
+    from urllib.parse import quote, unquote
+
+STATES = ['pending', 'leased', 'done', 'failed']
+
+parser = argparse.ArgumentParser(description='Manage a grasp mining job queue')
+parser.add_argument('queue', type=str, help="Queue directory")
+parser.add_argument('-m', '--models', nargs='*', default=[], help="Objects to add")
+parser.add_argument('-l', '--models_file', type=str, default='', help="File with objects to add")
+parser.add_argument('--retry_failed',
+                    action='store_true',
+                    help="Move failed objects back to pending")
+
+
+class JobQueue:
+    """ Lease-based queue of objects shared by mining workers
+
+    The queue is a directory with a file per object in one of the
+    pending, leased, done and failed subdirectories. Objects change state
+    by atomic renames, so workers on different hosts can share the queue
+    through a network file system.
+
+    A leased object belongs to a worker while it renews the lease. A lease
+    which is not renewed expires and the object is returned to pending,
+    or to failed once it has been leased max_attempts times.
+
+    """
+
+    def __init__(self, path, lease_time=600.0, max_attempts=3, poll=10.0):
+        """Constructor
+
+        Arguments:
+            path {str} -- queue directory
+
+        Keyword Arguments:
+            lease_time {float} -- lease expiry time, should exceed clock skew
+                between hosts, seconds (default: {600.0})
+            max_attempts {int} -- leases of an object before it fails (default: {3})
+            poll {float} -- wait between queue scans, seconds (default: {10.0})
+        """
+        self._path = path
+        self._lease_time = lease_time
+        self._max_attempts = max_attempts
+        self._poll = poll
+        self._owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._held = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        for state in STATES:
+            try:
+                os.makedirs(os.path.join(path, state))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _filename(self, state, name):
+        return os.path.join(self._path, state, quote(name, safe=''))
+
+    def _names(self, state):
+        return [unquote(f) for f in os.listdir(os.path.join(self._path, state))]
+
+    def _readJob(self, state, name):
+        try:
+            with open(self._filename(state, name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return dict(attempts=0)
+
+    def _writeJob(self, state, name, job):
+        with open(self._filename(state, name), 'w') as f:
+            json.dump(job, f)
+
+    def _move(self, name, src, dst):
+        """Atomically change the object state, return False if it is not in src state"""
+        try:
+            os.rename(self._filename(src, name), self._filename(dst, name))
+            return True
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+    def put(self, names):
+        """Add objects to the queue, objects already in the queue are skipped
+
+        Arguments:
+            names {iterable} -- object names
+
+        Returns:
+            int -- number of added objects
+        """
+        added = 0
+        for name in names:
+            if any(os.path.exists(self._filename(state, name)) for state in STATES):
+                continue
+            try:
+                fd = os.open(self._filename('pending', name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(attempts=0), f)
+            added += 1
+        return added
+
+    def counts(self):
+        """ Number of objects per state """
+        return dict((state, len(self._names(state))) for state in STATES)
+
+    def lease(self):
+        """Lease a pending object, expired leases are returned to pending first
+
+        Returns:
+            str -- object name or None if nothing is pending
+        """
+        self._reclaim()
+        for name in self._names('pending'):
+            if not self._move(name, 'pending', 'leased'):
+                continue  # leased by another worker
+            # rename keeps the old modification time, renew the lease before anything else
+            os.utime(self._filename('leased', name), None)
+            if os.path.exists(self._filename('done', name)):
+                os.remove(self._filename('leased', name))
+                continue
+            job = self._readJob('leased', name)
+            job.update(attempts=job.get('attempts', 0) + 1, owner=self._owner, leased=time.time())
+            self._writeJob('leased', name, job)
+            with self._lock:
+                self._held.add(name)
+            return name
+        return None
+
+    def _reclaim(self):
+        """Return objects with expired leases to pending"""
+        now = time.time()
+        for name in self._names('leased'):
+            if name in self._held:
+                continue
+            try:
+                expired = now - os.path.getmtime(self._filename('leased', name)) > self._lease_time
+            except OSError:
+                continue
+            if not expired:
+                continue
+            attempts = self._readJob('leased', name).get('attempts', 0)
+            state = 'failed' if attempts >= self._max_attempts else 'pending'
+            if self._move(name, 'leased', state):
+                print('{}: lease expired after attempt {}'.format(name, attempts))
+
+    def renew(self):
+        """Renew all leases held by this worker"""
+        with self._lock:
+            held = list(self._held)
+        for name in held:
+            try:
+                os.utime(self._filename('leased', name), None)
+            except OSError:
+                pass  # lease lost after a completion by another worker
+
+    def complete(self, name):
+        """Record a completed object
+
+        Arguments:
+            name {str} -- object name
+        """
+        with self._lock:
+            self._held.discard(name)
+        job = self._readJob('leased', name)
+        job.update(owner=self._owner, completed=time.time())
+        self._writeJob('done', name, job)
+        for state in ['leased', 'pending']:
+            try:
+                os.remove(self._filename(state, name))
+            except OSError:
+                pass
+
+    def fail(self, name):
+        """Give up a leased object, it is retried unless out of attempts
+
+        Arguments:
+            name {str} -- object name
+        """
+        with self._lock:
+            self._held.discard(name)
+        attempts = self._readJob('leased', name).get('attempts', 0)
+        self._move(name, 'leased', 'failed' if attempts >= self._max_attempts else 'pending')
+
+    def release(self):
+        """Return all leases held by this worker to pending"""
+        with self._lock:
+            held, self._held = self._held, set()
+        for name in held:
+            self._move(name, 'leased', 'pending')
+
+    def retry_failed(self):
+        """Move failed objects back to pending with a fresh attempts budget
+
+        Returns:
+            int -- number of moved objects
+        """
+        moved = 0
+        for name in self._names('failed'):
+            if self._move(name, 'failed', 'pending'):
+                self._writeJob('pending', name, dict(attempts=0))
+                moved += 1
+        return moved
+
+    def leases(self):
+        """Lease objects until the queue is drained
+
+        Leases are renewed in background while the stream is in use. While
+        this worker still holds leases the stream does not block: it yields
+        None when there is nothing to lease yet and polls the queue again
+        every poll seconds, so leases of crashed workers are retried once
+        they expire. Otherwise it waits for leases of other workers to
+        complete or expire. The stream ends when nothing is leased by anyone.
+
+        Yields:
+            str -- leased object name or None if nothing can be leased yet
+        """
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renewLoop)
+            self._heartbeat.daemon = True
+            self._heartbeat.start()
+        polled = None
+        while True:
+            with self._lock:
+                busy = bool(self._held)
+            if busy and polled is not None and time.time() - polled < self._poll:
+                yield None
+                continue
+            polled = time.time()
+            name = self.lease()
+            if name is not None:
+                yield name
+                continue
+            if not busy and not self._names('leased'):
+                return
+            if busy:
+                yield None
+            else:
+                time.sleep(self._poll)
+
+    def _renewLoop(self):
+        while True:
+            time.sleep(self._lease_time / 4.0)
+            self.renew()
+
+    def __repr__(self):
+        return ("Job queue: {} ({pending} pending, {leased} leased, {done} done, "
+                "{failed} failed)".format(self._path, **self.counts()))
+
+
+def main(args):
+    queue = JobQueue(args.queue)
+    models = list(args.models)
+    if args.models_file:
+        with open(args.models_file) as f:
+            models.extend(line.strip() for line in f if line.strip())
+    if models:
+        print('Added {} objects'.format(queue.put(models)))
+    if args.retry_failed:
+        print('Retrying {} failed objects'.format(queue.retry_failed()))
+    print(queue)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
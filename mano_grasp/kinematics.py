@@ -8,6 +8,27 @@ from math_utils import *
 CHAIN_NAME = collections.OrderedDict([('chain0', 'index'), ('chain1', 'mid'), ('chain2', 'ring'),
                                       ('chain3', 'pinky'), ('chain4', 'thumb')])
 
+LINK_NAMES = ['palm'] + ['{}_link{}'.format(c, i) for c in CHAIN_NAME.values() for i in range(3)]
+
+LINK_ID = dict((name, i) for i, name in enumerate(LINK_NAMES))
+
+_kinematics_cache = {}
+
+
+def load_kinematics(path):
+    """Kinematics of a robot, parsed once per process
+
+    Arguments:
+        path {str} -- path to to directory with a kinematics.json
+
+    Returns:
+        Kinematics -- shared converter
+    """
+    path = os.path.realpath(path)
+    if path not in _kinematics_cache:
+        _kinematics_cache[path] = Kinematics(path)
+    return _kinematics_cache[path]
+
 
 class Kinematics:
     """ Kinematics converter GraspIt -> MANO """
@@ -64,6 +85,52 @@ class Kinematics:
 
         return trans.tolist(), pose.tolist()
 
+    def getManoPoses(self, xyz, quat, dofs):
+        """Convert a batch of hand poses from GraspIt to MANO
+
+        Vectorized version of getManoPose, results agree with it to within 1e-9.
+
+        Arguments:
+            xyz  -- root positions, (N,3) array
+            quat -- root orientations, (N,4) array of quaternions x,y,z,w
+            dofs -- joint angles, (N,20) array
+
+        Returns:
+            trans -- MANO hand's translations, (N,3) array
+            pose  -- MANO hand's poses, (N,48) array
+        """
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        quat = np.asarray(quat, dtype=np.float64).reshape(-1, 4)
+        dofs = np.asarray(dofs, dtype=np.float64).reshape(len(xyz), -1)
+
+        pose = [rvecs_from_quats(quat)]
+        for chain in self._chains:
+            p0 = np.asarray(chain.mano_root_mat)
+            m0 = np.asarray(chain.solid_root_mat)
+            m = np.tile(m0, (len(xyz), 1, 1))
+            for i in range(4):
+                theta = dofs[:, chain.dof_index[i]] * chain.dof_coeff[i]
+                m0i = np.asarray(chain.tau0[i])
+                m0 = m0.dot(m0i)
+                mi = np.matmul(mats_rotate_z(theta), m0i)
+                zi = m[:, :, 2]
+                m = np.matmul(m, mi)
+
+                if i == 1:
+                    p = np.matmul(m, m0.T.dot(p0))
+                    pose.append(rvecs_from_mats(p))
+                elif i > 1:
+                    axis = np.einsum('nji,nj->ni', p, zi)
+                    rvec = axis * theta[:, None]
+                    p = np.matmul(p, mats_from_rvecs(rvec))
+                    pose.append(rvec)
+        pose = np.concatenate(pose, axis=1)
+
+        origin = np.asarray(self._origin)
+        trans = xyz - origin + np.einsum('nij,j->ni', mats_from_quats(quat), origin)
+
+        return trans, pose
+
 
 class Chain:
 
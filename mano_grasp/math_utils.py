@@ -67,3 +67,141 @@ def rvec_from_quat(quat):
 def quat_from_mat(mat):
     w, x, y, z = tf.quaternions.mat2quat(mat)
     return (x, y, z, w)
+
+
+def mats_rotate_x(alphas):
+    alphas = np.asarray(alphas, dtype=np.float64)
+    ca, sa = np.cos(alphas), np.sin(alphas)
+    mats = np.zeros(alphas.shape + (3, 3))
+    mats[..., 0, 0] = 1
+    mats[..., 1, 1] = ca
+    mats[..., 1, 2] = -sa
+    mats[..., 2, 1] = sa
+    mats[..., 2, 2] = ca
+    return mats
+
+
+def mats_rotate_y(betas):
+    betas = np.asarray(betas, dtype=np.float64)
+    cb, sb = np.cos(betas), np.sin(betas)
+    mats = np.zeros(betas.shape + (3, 3))
+    mats[..., 0, 0] = cb
+    mats[..., 0, 2] = sb
+    mats[..., 1, 1] = 1
+    mats[..., 2, 0] = -sb
+    mats[..., 2, 2] = cb
+    return mats
+
+
+def mats_rotate_z(thetas):
+    thetas = np.asarray(thetas, dtype=np.float64)
+    ct, st = np.cos(thetas), np.sin(thetas)
+    mats = np.zeros(thetas.shape + (3, 3))
+    mats[..., 0, 0] = ct
+    mats[..., 0, 1] = -st
+    mats[..., 1, 0] = st
+    mats[..., 1, 1] = ct
+    mats[..., 2, 2] = 1
+    return mats
+
+
+def mats_from_rvecs(rvecs):
+    rvecs = np.asarray(rvecs, dtype=np.float64)
+    angles = np.linalg.norm(rvecs, axis=-1)
+    axes = np.zeros_like(rvecs)
+    axes[..., 2] = 1
+    nonzero = angles != 0
+    axes[nonzero] = rvecs[nonzero] / angles[nonzero, None]
+    x, y, z = axes[..., 0], axes[..., 1], axes[..., 2]
+    c, s = np.cos(angles), np.sin(angles)
+    C = 1 - c
+    mats = np.empty(rvecs.shape[:-1] + (3, 3))
+    mats[..., 0, 0] = x * x * C + c
+    mats[..., 0, 1] = x * y * C - z * s
+    mats[..., 0, 2] = x * z * C + y * s
+    mats[..., 1, 0] = y * x * C + z * s
+    mats[..., 1, 1] = y * y * C + c
+    mats[..., 1, 2] = y * z * C - x * s
+    mats[..., 2, 0] = z * x * C - y * s
+    mats[..., 2, 1] = z * y * C + x * s
+    mats[..., 2, 2] = z * z * C + c
+    return mats
+
+
+def mats_from_quats(quats):
+    quats = np.asarray(quats, dtype=np.float64)
+    x, y, z, w = quats[..., 0], quats[..., 1], quats[..., 2], quats[..., 3]
+    nq = np.sum(quats * quats, axis=-1)
+    identity = nq < np.finfo(np.float64).eps
+    s = 2.0 / np.where(identity, 1.0, nq)
+    X, Y, Z = x * s, y * s, z * s
+    wX, wY, wZ = w * X, w * Y, w * Z
+    xX, xY, xZ = x * X, x * Y, x * Z
+    yY, yZ, zZ = y * Y, y * Z, z * Z
+    mats = np.empty(quats.shape[:-1] + (3, 3))
+    mats[..., 0, 0] = 1.0 - (yY + zZ)
+    mats[..., 0, 1] = xY - wZ
+    mats[..., 0, 2] = xZ + wY
+    mats[..., 1, 0] = xY + wZ
+    mats[..., 1, 1] = 1.0 - (xX + zZ)
+    mats[..., 1, 2] = yZ - wX
+    mats[..., 2, 0] = xZ - wY
+    mats[..., 2, 1] = yZ + wX
+    mats[..., 2, 2] = 1.0 - (xX + yY)
+    mats[identity] = np.eye(3)
+    return mats
+
+
+def rvecs_from_mats(mats, unit_thresh=1e-03):
+    mats = np.asarray(mats, dtype=np.float64)
+    flat = mats.reshape(-1, 3, 3)
+    # direction: unit eigenvector corresponding to eigenvalue of 1
+    L, W = np.linalg.eig(np.swapaxes(flat, -1, -2))
+    i = np.argmin(np.abs(L - 1.0), axis=-1)
+    rows = np.arange(len(flat))
+    if np.any(np.abs(L[rows, i] - 1.0) >= unit_thresh):
+        raise ValueError("no unit eigenvector corresponding to eigenvalue 1")
+    x, y, z = np.real(W[rows, :, i]).T
+    # rotation angle depending on direction
+    cosa = (np.trace(flat, axis1=-2, axis2=-1) - 1.0) / 2.0
+    use_z, use_y = np.abs(z) > 1e-8, np.abs(y) > 1e-8
+    num = np.where(use_z, flat[:, 1, 0] + (cosa - 1.0) * x * y,
+                   np.where(use_y, flat[:, 0, 2] + (cosa - 1.0) * x * z,
+                            flat[:, 2, 1] + (cosa - 1.0) * y * z))
+    den = np.where(use_z, z, np.where(use_y, y, x))
+    angles = np.arctan2(num / den, cosa)
+    rvecs = np.stack([x, y, z], axis=-1) * angles[:, None]
+    return rvecs.reshape(mats.shape[:-1])
+
+
+def rvecs_from_quats(quats, identity_thresh=1e-06):
+    quats = np.asarray(quats, dtype=np.float64)
+    nq = np.sum(quats * quats, axis=-1)
+    degenerate = nq < np.finfo(np.float64).eps**2
+    quats = quats / np.sqrt(np.where(degenerate, 1.0, nq))[..., None]
+    xyz, w = quats[..., :3], quats[..., 3]
+    len2 = np.sum(xyz * xyz, axis=-1)
+    identity = degenerate | (len2 < identity_thresh**2)
+    angles = 2 * np.arccos(np.clip(w, -1, 1))
+    scale = np.where(identity, 0.0, angles / np.sqrt(np.where(identity, 1.0, len2)))
+    return xyz * scale[..., None]
+
+
+def quats_from_mats(mats):
+    mats = np.asarray(mats, dtype=np.float64)
+    flat = mats.reshape(-1, 3, 3)
+    Qxx, Qyx, Qzx = flat[:, 0, 0], flat[:, 0, 1], flat[:, 0, 2]
+    Qxy, Qyy, Qzy = flat[:, 1, 0], flat[:, 1, 1], flat[:, 1, 2]
+    Qxz, Qyz, Qzz = flat[:, 2, 0], flat[:, 2, 1], flat[:, 2, 2]
+    # symmetric matrix K, its eigenvector of the largest eigenvalue is w,x,y,z
+    K = np.empty((len(flat), 4, 4))
+    K[:, 0] = np.stack([Qxx - Qyy - Qzz, Qyx + Qxy, Qzx + Qxz, Qyz - Qzy], axis=-1)
+    K[:, 1] = np.stack([Qyx + Qxy, Qyy - Qxx - Qzz, Qzy + Qyz, Qzx - Qxz], axis=-1)
+    K[:, 2] = np.stack([Qzx + Qxz, Qzy + Qyz, Qzz - Qxx - Qyy, Qxy - Qyx], axis=-1)
+    K[:, 3] = np.stack([Qyz - Qzy, Qzx - Qxz, Qxy - Qyx, Qxx + Qyy + Qzz], axis=-1)
+    K /= 3.0
+    _, V = np.linalg.eigh(K, UPLO='L')
+    # eigenvalues are in ascending order, the vector is x,y,z,w already
+    quats = V[:, :, -1]
+    quats[quats[:, 3] < 0] *= -1
+    return quats.reshape(mats.shape[:-2] + (4,))
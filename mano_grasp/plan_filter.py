@@ -0,0 +1,550 @@
+import collections
+import itertools
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from math_utils import mats_from_quats
+from scheduler import object_files
+
+PLY_TYPES = dict(char='i1', uchar='u1', short='i2', ushort='u2', int='i4', uint='u4',
+                 float='f4', double='f8', int8='i1', uint8='u1', int16='i2', uint16='u2',
+                 int32='i4', uint32='u4', float32='f4', float64='f8')
+
+NUMBER = r'-?\d*\.?\d+(?:[eE][-+]?\d+)?'
+
+# generic ray directions of the inside test, off axes and faces diagonals
+RAY_DIRECTIONS = np.array([[0.5773, 0.5779, 0.5770], [-0.4083, 0.8167, 0.4081]])
+
+
+class PlanDeduplicator:
+    """ Near-duplicate plans elimination
+
+    Kept plans are indexed by a grid over hand root positions, so a plan
+    is compared only to plans from the neighbouring cells. A plan is a
+    duplicate if it is closer to a kept plan than all the tolerances.
+
+    """
+
+    def __init__(self, position_tol=0.005, orientation_tol=0.1, dofs_tol=0.1):
+        """Constructor
+
+        Keyword Arguments:
+            position_tol {float} -- hand root distance, meters (default: {0.005})
+            orientation_tol {float} -- hand root rotation angle, radians (default: {0.1})
+            dofs_tol {float} -- max joint angle difference, radians (default: {0.1})
+        """
+        self._position_tol = position_tol
+        self._min_dot = np.cos(orientation_tol / 2.0)
+        self._dofs_tol = dofs_tol
+
+    def __call__(self, plans):
+        """Drop near-duplicate plans, the first plan of each group is kept
+
+        Arguments:
+            plans {list} -- plans with 'pose' and 'dofs'
+
+        Returns:
+            list -- kept plans
+        """
+        if not plans:
+            return []
+        poses = np.array([p['pose'] for p in plans], dtype=np.float64)
+        dofs = np.array([p['dofs'] for p in plans], dtype=np.float64)
+        positions, quats = poses[:, :3], poses[:, 3:]
+        quats /= np.linalg.norm(quats, axis=1)[:, None]
+        cells = np.floor(positions / self._position_tol).astype(np.int64)
+
+        grid = collections.defaultdict(list)
+        offsets = list(itertools.product((-1, 0, 1), repeat=3))
+        kept = []
+        for i, cell in enumerate(map(tuple, cells)):
+            near = [j for o in offsets for j in grid.get(tuple(np.add(cell, o)), ())]
+            if near and np.any(
+                    (np.linalg.norm(positions[near] - positions[i], axis=1) <= self._position_tol)
+                    & (np.abs(quats[near].dot(quats[i])) >= self._min_dot)
+                    & (np.abs(dofs[near] - dofs[i]).max(axis=1) <= self._dofs_tol)):
+                continue
+            grid[cell].append(i)
+            kept.append(i)
+        return [plans[i] for i in kept]
+
+    def __repr__(self):
+        return "Plan deduplicator"
+
+
+def load_mesh(filename):
+    """Triangle mesh of an OFF, PLY, OBJ, VRML or Inventor file
+
+    Polygons are split to triangle fans, VRML and Inventor transforms
+    are ignored.
+
+    Arguments:
+        filename {str} -- mesh file
+
+    Returns:
+        tuple -- (N,3) vertices and (F,3) triangles, None if the format is unknown
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.off':
+        with open(filename, 'rb') as f:
+            tokens = f.read().split()
+        if tokens[0].endswith(b'OFF'):
+            tokens = tokens[1:]
+        n_vertices, n_faces = int(tokens[0]), int(tokens[1])
+        vertices = np.array(tokens[3:3 + 3 * n_vertices], dtype=np.float64).reshape(-1, 3)
+        values = [int(t) for t in tokens[3 + 3 * n_vertices:]]
+        polygons, pos = [], 0
+        for _ in range(n_faces):
+            polygons.append(values[pos + 1:pos + 1 + values[pos]])
+            pos += 1 + values[pos]
+    elif ext == '.obj':
+        vertices, polygons = [], []
+        with open(filename, 'rb') as f:
+            for line in f:
+                fields = line.split()
+                if fields[:1] == [b'v']:
+                    vertices.append([float(v) for v in fields[1:4]])
+                elif fields[:1] == [b'f']:
+                    index = [int(v.split(b'/')[0]) for v in fields[1:]]
+                    polygons.append([i - 1 if i > 0 else len(vertices) + i for i in index])
+        vertices = np.array(vertices, dtype=np.float64).reshape(-1, 3)
+    elif ext == '.ply':
+        vertices, polygons = _loadPly(filename)
+    elif ext in ['.wrl', '.iv']:
+        with open(filename, 'rb') as f:
+            text = f.read().decode('latin-1')
+        vertices, polygons = [], []
+        for points, index in zip(re.findall(r'point\s*\[([^\]]*)\]', text),
+                                 re.findall(r'coordIndex\s*\[([^\]]*)\]', text)):
+            offset = len(vertices)
+            vertices.extend(np.array(points.replace(',', ' ').split(), np.float64).reshape(-1, 3))
+            polygon = []
+            for i in index.replace(',', ' ').split():
+                if int(i) < 0:
+                    polygons.append(polygon)
+                    polygon = []
+                else:
+                    polygon.append(offset + int(i))
+            polygons.append(polygon)
+        vertices = np.array(vertices, dtype=np.float64).reshape(-1, 3)
+    else:
+        return None
+    if isinstance(polygons, np.ndarray):
+        return vertices, polygons
+    faces = [(p[0], p[i], p[i + 1]) for p in polygons for i in range(1, len(p) - 1)]
+    return vertices, np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+
+def _loadPly(filename):
+    with open(filename, 'rb') as f:
+        elements, fmt = [], 'ascii'
+        for line in iter(f.readline, b''):
+            fields = line.decode('latin-1').split()
+            if fields[:1] == ['format']:
+                fmt = fields[1]
+            elif fields[:1] == ['element']:
+                elements.append((fields[1], int(fields[2]), []))
+            elif fields[:1] == ['property']:
+                elements[-1][2].append(fields[1:])
+            elif fields[:1] == ['end_header']:
+                break
+        data = f.read()
+
+    vertices, polygons = np.zeros((0, 3)), []
+    if fmt == 'ascii':
+        lines = iter(data.decode('latin-1').splitlines())
+        for name, count, props in elements:
+            rows = [next(lines).split() for _ in range(count)]
+            if name == 'vertex':
+                names = [p[-1] for p in props]
+                columns = [names.index(c) for c in 'xyz']
+                vertices = np.array([[float(r[c]) for c in columns] for r in rows])
+            elif name == 'face':
+                polygons = [[int(v) for v in r[1:1 + int(r[0])]] for r in rows]
+        return vertices, polygons
+
+    endian = '<' if fmt == 'binary_little_endian' else '>'
+    pos = 0
+    for name, count, props in elements:
+        if props and props[0][0] == 'list':
+            count_type = np.dtype(endian + PLY_TYPES[props[0][1]])
+            index_type = np.dtype(endian + PLY_TYPES[props[0][2]])
+            # triangle meshes are read at once
+            triangles = np.dtype([('n', count_type), ('v', index_type, (3,))])
+            if len(data) >= pos + count * triangles.itemsize:
+                rows = np.frombuffer(data, triangles, count, pos)
+                if np.all(rows['n'] == 3):
+                    pos += count * triangles.itemsize
+                    if name == 'face':
+                        polygons = rows['v'].astype(np.int64)
+                    continue
+            for _ in range(count):
+                n = int(np.frombuffer(data, count_type, 1, pos)[0])
+                pos += count_type.itemsize
+                polygon = np.frombuffer(data, index_type, n, pos)
+                pos += n * index_type.itemsize
+                if name == 'face':
+                    polygons.append(polygon.tolist())
+        else:
+            dtype = np.dtype([(p[-1], endian + PLY_TYPES[p[0]]) for p in props])
+            rows = np.frombuffer(data, dtype, count, pos)
+            pos += count * dtype.itemsize
+            if name == 'vertex':
+                vertices = np.stack([rows[c].astype(np.float64) for c in 'xyz'], axis=1)
+    return vertices, polygons
+
+
+def surface_samples(vertices, faces, spacing):
+    """Points on mesh triangles
+
+    Arguments:
+        vertices {array} -- (N,3) vertices
+        faces {array} -- (F,3) triangles
+        spacing {float} -- max distance between neighbour points of a triangle
+
+    Returns:
+        array -- (M,3) points, triangle vertices included
+    """
+    a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    edges = np.stack([b - a, c - b, a - c], axis=1)
+    steps = np.ceil(np.linalg.norm(edges, axis=2).max(axis=1) / spacing).astype(np.int64)
+    steps = np.clip(steps, 1, 256)
+    samples = [vertices]
+    for n in np.unique(steps):
+        i, j = np.mgrid[0:n + 1, 0:n + 1]
+        keep = i + j <= n
+        u, v = i[keep] / float(n), j[keep] / float(n)
+        tri = steps == n
+        ta, tb, tc = a[tri], b[tri], c[tri]
+        samples.append((ta[:, None] + u[None, :, None] * (tb - ta)[:, None] + v[None, :, None] *
+                        (tc - ta)[:, None]).reshape(-1, 3))
+    return np.concatenate(samples)
+
+
+class ObjectDistance:
+    """ Signed distance of points to an object surface
+
+    Distances are looked up in a voxel grid filled by dilation from the
+    voxels of the surface samples, so they are lower bounds accurate to
+    a voxel and capped by max_distance. A point is inside if rays in two
+    generic directions cross the surface an odd number of times.
+
+    """
+
+    def __init__(self, vertices, faces, max_distance, resolution=64):
+        """Constructor
+
+        Arguments:
+            vertices {array} -- (N,3) mesh vertices, meters
+            faces {array} -- (F,3) triangles
+            max_distance {float} -- max distance of interest, meters
+
+        Keyword Arguments:
+            resolution {int} -- voxels along the longest object side (default: {64})
+        """
+        extent = max(np.ptp(vertices, axis=0).max(), 1e-6)
+        self._voxel = max(extent / resolution, max_distance / 16.0)
+        self._steps = int(np.ceil(max_distance / self._voxel)) + 1
+        margin = (self._steps + 1) * self._voxel
+        self._origin = vertices.min(axis=0) - margin
+        shape = np.ceil((np.ptp(vertices, axis=0) + 2 * margin) / self._voxel).astype(int) + 1
+
+        samples = surface_samples(vertices, faces, self._voxel / 2.0)
+        cells = np.floor((samples - self._origin) / self._voxel).astype(np.int64)
+        reached = np.zeros(shape, dtype=bool)
+        reached[tuple(cells.T)] = True
+        self._steps_grid = np.full(shape, self._steps + 1, dtype=np.uint8)
+        self._steps_grid[reached] = 0
+        for k in range(1, self._steps + 1):
+            grown = _dilate(reached)
+            self._steps_grid[grown & ~reached] = k
+            reached = grown
+
+        # per triangle terms of ray intersections, see inside()
+        a = vertices[faces[:, 0]]
+        e1 = vertices[faces[:, 1]] - a
+        e2 = vertices[faces[:, 2]] - a
+        self._rays = []
+        for direction in RAY_DIRECTIONS / np.linalg.norm(RAY_DIRECTIONS, axis=1)[:, None]:
+            det = np.einsum('ij,ij->i', e1, np.cross(direction, e2))
+            valid = np.abs(det) > 1e-12
+            terms = np.stack([np.cross(direction, e2), np.cross(e1, direction), np.cross(e1, e2)
+                              ])[:, valid] / det[valid][None, :, None]
+            self._rays.append((terms, np.einsum('kfi,fi->kf', terms, a[valid])))
+
+    @property
+    def voxel(self):
+        return self._voxel
+
+    def distance(self, points):
+        """Unsigned distance to the surface
+
+        Arguments:
+            points {array} -- (N,3) points, meters
+
+        Returns:
+            array -- lower bounds of distances, inf beyond max_distance
+        """
+        cells = np.floor((points - self._origin) / self._voxel).astype(np.int64)
+        inside = np.all((cells >= 0) & (cells < self._steps_grid.shape), axis=1)
+        steps = np.full(len(points), self._steps + 1)
+        steps[inside] = self._steps_grid[tuple(cells[inside].T)]
+        distance = np.maximum(steps - 1, 0) * self._voxel
+        distance[steps > self._steps] = np.inf
+        return distance
+
+    def inside(self, points):
+        """Check that points are inside the object
+
+        Arguments:
+            points {array} -- (N,3) points, meters
+
+        Returns:
+            array -- mask of points inside the surface
+        """
+        inside = np.ones(len(points), dtype=bool)
+        for terms, offsets in self._rays:
+            for start in range(0, len(points), 64):
+                chunk = points[start:start + 64]
+                # barycentric coordinates and ray parameter of crossings
+                u, v, t = [chunk.dot(terms[k].T) - offsets[k] for k in range(3)]
+                hits = (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+                inside[start:start + 64] &= hits.sum(axis=1) % 2 == 1
+        return inside
+
+
+def _dilate(mask):
+    """ Grow a 3d mask by a voxel, diagonals included """
+    for axis in range(mask.ndim):
+        grown = mask.copy()
+        lo = [slice(None)] * mask.ndim
+        hi = [slice(None)] * mask.ndim
+        lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+        grown[tuple(hi)] |= mask[tuple(lo)]
+        grown[tuple(lo)] |= mask[tuple(hi)]
+        mask = grown
+    return mask
+
+
+class HandPoints:
+    """ Palm and fingertips positions of a GraspIt hand
+
+    Forward kinematics follows the chains of the robot XML, a point of
+    a link is the centroid of its mesh: the palm and the last link of
+    every chain.
+
+    """
+
+    def __init__(self, robot_dir, scale=0.001):
+        """Constructor
+
+        Arguments:
+            robot_dir {str} -- GraspIt robot directory with <robot>.xml
+
+        Keyword Arguments:
+            scale {float} -- robot model units, meters (default: {0.001})
+        """
+        name = os.path.basename(os.path.normpath(robot_dir))
+        root = ET.parse(os.path.join(robot_dir, '{}.xml'.format(name))).getroot()
+        iv_dir = os.path.join(robot_dir, 'iv')
+        self._scale = scale
+        self._palm = _linkCentroid(iv_dir, root.find('palm').text.strip())
+        self._chains = []
+        for chain in root.findall('chain'):
+            base = _transform(chain.find('transform'))
+            joints = []
+            for joint in chain.findall('joint'):
+                match = re.match(r'\s*d(\d+)\s*(?:\*\s*({0}))?\s*(?:\+\s*({0}))?'.format(NUMBER),
+                                 joint.find('theta').text)
+                joints.append((int(match.group(1)), float(match.group(2) or 1.0),
+                               float(match.group(3) or 0.0)) +
+                              tuple(float(joint.find(k).text) for k in ['d', 'a', 'alpha']))
+            tip = _linkCentroid(iv_dir, chain.findall('link')[-1].text.strip())
+            self._chains.append((base, joints, tip))
+
+    def frames(self, dofs):
+        """Joint frames of every chain in the palm frame
+
+        Arguments:
+            dofs {array} -- (N,D) hand dofs angles, radians
+
+        Returns:
+            list -- per chain, (N,4,4) transforms after each joint, robot model units
+        """
+        degrees = np.degrees(np.asarray(dofs, dtype=np.float64))
+        degrees = degrees.reshape(-1, degrees.shape[-1])
+        frames = []
+        for base, joints, _ in self._chains:
+            m = np.tile(base, (len(degrees), 1, 1))
+            chain_frames = []
+            for index, coeff, offset, d, a, alpha in joints:
+                m = np.matmul(m, _dh(np.radians(degrees[:, index] * coeff + offset), d, a,
+                                     np.radians(alpha)))
+                chain_frames.append(m)
+            frames.append(chain_frames)
+        return frames
+
+    def __call__(self, poses, dofs):
+        """Palm and fingertips positions
+
+        Arguments:
+            poses {array} -- (N,7) hand root poses, position and quaternion x,y,z,w
+            dofs {array} -- (N,D) hand dofs angles, radians
+
+        Returns:
+            array -- (N,1+chains,3) palm and fingertips positions, meters
+        """
+        poses = np.asarray(poses, dtype=np.float64).reshape(-1, 7)
+        dofs = np.asarray(dofs, dtype=np.float64).reshape(len(poses), -1)
+        points = [np.tile(self._palm, (len(poses), 1))]
+        for chain_frames, (_, _, tip) in zip(self.frames(dofs), self._chains):
+            m = chain_frames[-1]
+            points.append(np.einsum('nij,j->ni', m[:, :3, :3], tip) + m[:, :3, 3])
+        points = np.stack(points, axis=1) * self._scale
+        rotations = mats_from_quats(poses[:, 3:])
+        return np.einsum('nij,nkj->nki', rotations, points) + poses[:, None, :3]
+
+
+def _linkCentroid(iv_dir, link_file):
+    geometry = ET.parse(os.path.join(iv_dir, link_file)).getroot().find('geometryFile')
+    vertices, _ = load_mesh(os.path.join(iv_dir, geometry.text.strip()))
+    return vertices.mean(axis=0)
+
+
+def _transform(element):
+    """ Homogeneous matrix of a GraspIt XML transform, children applied in order """
+    m = np.eye(4)
+    for child in element if element is not None else []:
+        values = child.text.split()
+        step = np.eye(4)
+        if child.tag == 'translation':
+            step[:3, 3] = [float(v) for v in values]
+        elif child.tag == 'rotation':
+            angle = np.radians(float(values[0]))
+            i, j = [k for k in range(3) if k != 'xyz'.index(values[1])]
+            step[[i, i, j, j], [i, j, i, j]] = [np.cos(angle), -np.sin(angle),
+                                                np.sin(angle), np.cos(angle)]
+            if values[1] == 'y':
+                step[[i, j], [j, i]] *= -1
+        elif child.tag == 'rotationMatrix':
+            # GraspIt matrices act on row vectors
+            step[:3, :3] = np.reshape([float(v) for v in values], (3, 3)).T
+        m = m.dot(step)
+    return m
+
+
+def _dh(theta, d, a, alpha):
+    """ (N,4,4) Denavit-Hartenberg transforms, rotz(theta) transz(d) transx(a) rotx(alpha) """
+    ct, st = np.cos(theta), np.sin(theta)
+    ca, sa = np.cos(alpha), np.sin(alpha)
+    m = np.zeros((len(theta), 4, 4))
+    m[:, 0] = np.stack([ct, -st * ca, st * sa, a * ct], axis=1)
+    m[:, 1] = np.stack([st, ct * ca, -ct * sa, a * st], axis=1)
+    m[:, 2] = [0, sa, ca, d]
+    m[:, 3] = [0, 0, 0, 1]
+    return m
+
+
+class PlanPrefilter:
+    """ Rejection of implausible plans before simulation
+
+    The palm and fingertips of a plan are placed with the hand forward
+    kinematics and checked against a signed distance grid of the object
+    mesh. A plan is rejected if any of the points is deeper than
+    max_depth inside the object or all of them are farther than
+    max_distance from it. Distances are lower bounds, so only clear
+    cases are rejected.
+
+    """
+
+    def __init__(self, objects_dir, max_distance=0.05, max_depth=0.01, resolution=64,
+                 mesh_scale=0.001):
+        """Constructor
+
+        Arguments:
+            objects_dir {str} -- GraspIt graspable bodies directory
+
+        Keyword Arguments:
+            max_distance {float} -- max distance of the hand to the object, meters
+                (default: {0.05})
+            max_depth {float} -- max penetration of the hand into the object, meters
+                (default: {0.01})
+            resolution {int} -- voxels along the longest object side (default: {64})
+            mesh_scale {float} -- object mesh units, meters (default: {0.001})
+        """
+        self._objects_dir = objects_dir
+        self._max_distance = max_distance
+        self._max_depth = max_depth
+        self._resolution = resolution
+        self._mesh_scale = mesh_scale
+        self._hands = {}
+        self._body = None
+        self._distance = None
+        self._stats = {}
+
+    @property
+    def params(self):
+        """ Parameters affecting the result """
+        return dict(max_distance=self._max_distance,
+                    max_depth=self._max_depth,
+                    resolution=self._resolution,
+                    mesh_scale=self._mesh_scale)
+
+    @property
+    def stats(self):
+        """ Statistics of the last call """
+        return self._stats
+
+    def _objectDistance(self, body):
+        if body != self._body:
+            self._body, self._distance = body, None
+            files = object_files(self._objects_dir, body)
+            mesh = load_mesh(files[1]) if len(files) > 1 else None
+            if mesh is not None and len(mesh[1]):
+                self._distance = ObjectDistance(mesh[0] * self._mesh_scale, mesh[1],
+                                                max(self._max_distance, self._max_depth),
+                                                self._resolution)
+        return self._distance
+
+    def __call__(self, plans, robot_dir, body):
+        """Drop plans far from the object or penetrating it
+
+        Plans of objects without a readable mesh are kept.
+
+        Arguments:
+            plans {list} -- plans with 'pose' and 'dofs'
+            robot_dir {str} -- GraspIt robot directory
+            body {str} -- graspable body name
+
+        Returns:
+            list -- kept plans
+        """
+        started = time.time()
+        self._stats = dict(far=0, penetrating=0)
+        distance = self._objectDistance(body) if plans else None
+        if distance is None:
+            self._stats['time'] = time.time() - started
+            return plans
+        if robot_dir not in self._hands:
+            self._hands[robot_dir] = HandPoints(robot_dir)
+
+        points = self._hands[robot_dir]([p['pose'] for p in plans], [p['dofs'] for p in plans])
+        flat = points.reshape(-1, 3)
+        distances = distance.distance(flat)
+        deep = np.zeros(len(flat), dtype=bool)
+        candidates = np.flatnonzero(distances > self._max_depth)
+        deep[candidates] = distance.inside(flat[candidates])
+        deep = deep.reshape(points.shape[:2]).any(axis=1)
+        far = (distances.reshape(points.shape[:2]) > self._max_distance).all(axis=1) & ~deep
+
+        self._stats = dict(far=int(far.sum()),
+                           penetrating=int(deep.sum()),
+                           time=time.time() - started)
+        return [plan for plan, reject in zip(plans, far | deep) if not reject]
+
+    def __repr__(self):
+        return "Plan prefilter: {}".format(self._objects_dir)
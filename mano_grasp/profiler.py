@@ -0,0 +1,193 @@
+import collections
+import contextlib
+import json
+import time
+
+import numpy as np
+
+# upper bounds of latency histogram buckets, seconds, the last bucket is unbounded
+BUCKETS = [1e-5 * 10**(k / 4.0) for k in range(33)]
+
+
+class Profiler:
+    """ Call profiler
+
+    Records call counts, latency histograms and failure counts per call
+    type, object and robot model. A disabled profiler records nothing.
+
+    """
+
+    def __init__(self, enabled=True):
+        """Constructor
+
+        Keyword Arguments:
+            enabled {bool} -- record calls (default: {True})
+        """
+        self._enabled = enabled
+        self._records = {}
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def record(self, call, elapsed, failed=False, object_name='', robot=''):
+        """Record a single call
+
+        Arguments:
+            call {str} -- call type
+            elapsed {float} -- call latency, seconds
+
+        Keyword Arguments:
+            failed {bool} -- call failed (default: {False})
+            object_name {str} -- object name (default: {''})
+            robot {str} -- robot name (default: {''})
+        """
+        if not self._enabled:
+            return
+        key = (call, object_name, robot)
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = _emptyRecord()
+        record['count'] += 1
+        record['failures'] += int(failed)
+        record['total'] += elapsed
+        record['max'] = max(record['max'], elapsed)
+        record['histogram'][int(np.searchsorted(BUCKETS, elapsed))] += 1
+
+    @contextlib.contextmanager
+    def section(self, call, object_name='', robot=''):
+        """Context manager recording a code section as a call, an exception is a failure"""
+        if not self._enabled:
+            yield
+            return
+        started = time.time()
+        try:
+            yield
+        except BaseException:
+            self.record(call, time.time() - started, True, object_name, robot)
+            raise
+        self.record(call, time.time() - started, False, object_name, robot)
+
+    def wrap(self, target, object_name='', robot=''):
+        """Record all method calls of the target
+
+        A call fails if it raises or returns a response with a non-zero result.
+
+        Arguments:
+            target -- object to profile, e.g. a GraspitCommander
+
+        Returns:
+            proxy of the target or the target itself for a disabled profiler
+        """
+        if not self._enabled:
+            return target
+        return _Profiled(target, self, object_name, robot)
+
+    def data(self):
+        """ Recorded calls in a serializable form """
+        return [dict(record, call=call, object=object_name, robot=robot)
+                for (call, object_name, robot), record in self._records.items()]
+
+    def pop(self):
+        """ Recorded calls in a serializable form, the profiler is cleared """
+        data = self.data()
+        self._records = {}
+        return data
+
+    def merge(self, data):
+        """Add calls recorded by another profiler
+
+        Arguments:
+            data {list} -- Profiler.data() output
+        """
+        for entry in data:
+            key = (entry['call'], entry['object'], entry['robot'])
+            record = self._records.get(key)
+            if record is None:
+                record = self._records[key] = _emptyRecord()
+            for name in ['count', 'failures', 'total']:
+                record[name] += entry[name]
+            record['max'] = max(record['max'], entry['max'])
+            record['histogram'] = [a + b for a, b in zip(record['histogram'], entry['histogram'])]
+
+    def dump(self, path):
+        """Write recorded calls to a JSON file
+
+        Arguments:
+            path {str} -- output file
+        """
+        with open(path, 'w') as f:
+            json.dump(dict(buckets=BUCKETS, records=self.data()), f)
+
+    def summary(self):
+        """Summary table per call type
+
+        Returns:
+            str -- table with call counts, failures and latencies
+        """
+        calls = collections.OrderedDict()
+        for (call, _, _), record in sorted(self._records.items()):
+            total = calls.setdefault(call, _emptyRecord())
+            for name in ['count', 'failures', 'total']:
+                total[name] += record[name]
+            total['max'] = max(total['max'], record['max'])
+            total['histogram'] = [a + b for a, b in zip(total['histogram'], record['histogram'])]
+
+        header = '{:<24} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'
+        row = '{:<24} {:>8} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'
+        lines = [
+            header.format('call', 'count', 'failed', 'total s', 'mean ms', 'p50 ms', 'p95 ms',
+                          'max ms')
+        ]
+        for call, total in calls.items():
+            lines.append(
+                row.format(call, total['count'], total['failures'], total['total'],
+                           1e3 * total['total'] / max(total['count'], 1),
+                           1e3 * _quantile(total['histogram'], total['max'], 0.5),
+                           1e3 * _quantile(total['histogram'], total['max'], 0.95),
+                           1e3 * total['max']))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return "Profiler: {} records".format(len(self._records))
+
+
+def _emptyRecord():
+    return dict(count=0, failures=0, total=0.0, max=0.0, histogram=[0] * (len(BUCKETS) + 1))
+
+
+def _quantile(histogram, maximum, q):
+    """Quantile upper bound from a latency histogram"""
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] == 0:
+        return 0.0
+    k = int(np.searchsorted(cumulative, q * cumulative[-1]))
+    return min(BUCKETS[k], maximum) if k < len(BUCKETS) else maximum
+
+
+class _Profiled(object):
+    """ Proxy recording method calls of the target """
+
+    def __init__(self, target, profiler, object_name, robot):
+        self._target = target
+        self._profiler = profiler
+        self._object_name = object_name
+        self._robot = robot
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            started = time.time()
+            failed = True
+            try:
+                response = attr(*args, **kwargs)
+                failed = getattr(response, 'result', 0) != 0
+                return response
+            finally:
+                elapsed = time.time() - started
+                self._profiler.record(name, elapsed, failed, self._object_name, self._robot)
+
+        return call
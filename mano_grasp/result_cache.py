@@ -0,0 +1,225 @@
+#!/usr/bin/env python2
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from scheduler import object_files
+
+parser = argparse.ArgumentParser(description='Grasp mining result cache report')
+parser.add_argument('cache_dir', type=str, help="Cache directory")
+parser.add_argument('--max_size',
+                    type=float,
+                    default=0,
+                    help="Evict least recently used entries down to a size, GB")
+
+
+class ResultCache:
+    """ Content-addressed cache of mined grasps
+
+    An entry is keyed by a hash of the object mesh files, hand model files
+    and mining parameters, so any change of them is a miss. Entries are
+    written atomically and are shared by concurrent workers. Least
+    recently used entries are evicted above the size limit. Lookups are
+    appended to an access log used by the hit rate report.
+
+    """
+
+    def __init__(self, path, objects_dir, max_size=10 * 2**30):
+        """Constructor
+
+        Arguments:
+            path {str} -- cache directory
+            objects_dir {str} -- GraspIt graspable bodies directory
+
+        Keyword Arguments:
+            max_size {int} -- cache size limit, bytes (default: {10 GB})
+        """
+        self._path = path
+        self._objects_dir = objects_dir
+        self._max_size = max_size
+        self._hashes = {}
+        self._size = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _fileHash(self, filename):
+        stat = os.stat(filename)
+        key = (os.path.realpath(filename), stat.st_size, stat.st_mtime)
+        if key not in self._hashes:
+            sha = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(block)
+            self._hashes[key] = sha.hexdigest()
+        return self._hashes[key]
+
+    def key(self, object_name, robots_dir, robot_names, params):
+        """Cache key of an object
+
+        Arguments:
+            object_name {str} -- object name
+            robots_dir {str} -- GraspIt robots directory
+            robot_names {list} -- hand models used for the object
+            params {dict} -- mining parameters affecting the result
+
+        Returns:
+            str -- key or None if the object files are not found
+        """
+        files = object_files(self._objects_dir, object_name)
+        if len(files) < 2:
+            return None
+        for robot in robot_names:
+            files += [
+                os.path.join(robots_dir, robot, '{}.xml'.format(robot)),
+                os.path.join(robots_dir, robot, 'kinematics.json')
+            ]
+        sha = hashlib.sha1()
+        sha.update(object_name.encode('utf-8'))
+        sha.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        for filename in files:
+            if not os.path.isfile(filename):
+                return None
+            sha.update(self._fileHash(filename).encode('utf-8'))
+        return sha.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self._path, key[:2], '{}.json.gz'.format(key))
+
+    def get(self, key, object_name=''):
+        """Cached grasps
+
+        Arguments:
+            key {str} -- cache key
+
+        Keyword Arguments:
+            object_name {str} -- object name for the access log (default: {''})
+
+        Returns:
+            list -- grasps or None on a miss
+        """
+        grasps = None
+        try:
+            with gzip.open(self._filename(key), 'rb') as f:
+                grasps = json.loads(f.read().decode('utf-8'))
+            os.utime(self._filename(key), None)
+        except (IOError, OSError, ValueError):
+            pass  # missing or evicted by a concurrent worker
+        with open(os.path.join(self._path, 'access.log'), 'a') as f:
+            f.write(json.dumps(dict(time=time.time(), object=object_name,
+                                    hit=grasps is not None)) + '\n')
+        return grasps
+
+    def put(self, key, grasps):
+        """Store grasps, least recently used entries are evicted above the size limit
+
+        The cache is scanned once, then its size is estimated from the
+        entries written by this instance, and scanned again only when the
+        estimate exceeds the limit, to evict down to 90% of it. Entries of
+        concurrent workers are accounted for at the next scan.
+
+        Arguments:
+            key {str} -- cache key
+            grasps {list} -- object grasps
+        """
+        filename = self._filename(key)
+        if not os.path.isdir(os.path.dirname(filename)):
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError:
+                pass  # created by a concurrent worker
+        if self._size is None:
+            self._size = sum(e[1] for e in self.entries())
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(json.dumps(grasps).encode('utf-8'))
+            self._size += os.path.getsize(tmp_path)
+            os.rename(tmp_path, filename)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if self._size > self._max_size:
+            # evict with a margin, so a full cache is not scanned on every put
+            self.evict(int(self._max_size * 0.9))
+
+    def entries(self):
+        """Cache entries
+
+        Returns:
+            list -- (modification time, size, filename) tuples
+        """
+        entries = []
+        for root, _, files in os.walk(self._path):
+            for name in files:
+                if not name.endswith('.json.gz'):
+                    continue
+                filename = os.path.join(root, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        return entries
+
+    def evict(self, max_size):
+        """Remove least recently used entries down to a size
+
+        Arguments:
+            max_size {int} -- size limit, bytes
+
+        Returns:
+            int -- number of removed entries
+        """
+        entries = sorted(self.entries())
+        size = sum(e[1] for e in entries)
+        removed = 0
+        for _, entry_size, filename in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(filename)
+                removed += 1
+            except OSError:
+                pass
+            size -= entry_size
+        self._size = size
+        return removed
+
+    def report(self):
+        """Cache summary
+
+        Returns:
+            str -- entries, size and hit rate
+        """
+        hits, lookups = 0, 0
+        try:
+            with open(os.path.join(self._path, 'access.log')) as f:
+                for line in f:
+                    try:
+                        hits += int(json.loads(line)['hit'])
+                        lookups += 1
+                    except ValueError:
+                        continue
+        except IOError:
+            pass
+        entries = self.entries()
+        return 'entries: {}, size: {:.1f} MB, lookups: {}, hits: {}, hit rate: {:.0%}'.format(
+            len(entries),
+            sum(e[1] for e in entries) / 2.0**20, lookups, hits,
+            float(hits) / lookups if lookups else 0.0)
+
+    def __repr__(self):
+        return "Result cache: {}".format(self._path)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    cache = ResultCache(args.cache_dir, '')
+    if args.max_size > 0:
+        print('Evicted {} entries'.format(cache.evict(int(args.max_size * 2**30))))
+    print(cache.report())
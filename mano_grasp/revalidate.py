@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+
+import argparse
+import os
+import time
+from functools import partial
+
+import numpy as np
+
+from graspit_pool import GraspitPool
+from graspit_process import GraspitProcess
+from graspit_scene import GraspitScene
+from grasp_catalog import GraspCatalog
+from grasp_store import GraspStoreWriter
+from grasp_utils import arrays_from_states, grasps_from_states, select_grasps
+from grasp_writer import GraspWriter, open_reader
+
+parser = argparse.ArgumentParser(description='Replay stored grasps and recompute their quality')
+parser.add_argument('path_in', type=str, help="Directory with mined grasps (JSON or grasp store)")
+parser.add_argument('path_out', type=str, help="Output directory for grasps which still succeed")
+parser.add_argument('-m', '--models', nargs='*', default=[], help="Objects (default: all)")
+parser.add_argument('-n', '--n_jobs', type=int, default=1)
+parser.add_argument('-r', '--robot', type=str, default='ManoHand', help="Hand model")
+parser.add_argument('-v', '--verbose', action='store_true')
+parser.add_argument('-x',
+                    '--xvfb',
+                    action='store_true',
+                    help="Start with Xserver Virtual Frame Buffer (Xvfb)")
+parser.add_argument('-f',
+                    '--format',
+                    choices=['json', 'store'],
+                    default='json',
+                    help="Output format: a <body>.json per object or a columnar grasp store")
+parser.add_argument('--catalog',
+                    action='store_true',
+                    help="Index saved objects in catalog.sqlite of the output directory")
+parser.add_argument('--graspit_dir',
+                    type=str,
+                    default=os.environ.get('GRASPIT', ''),
+                    help="Path to GraspIt root directory")
+parser.add_argument('--plugin_dir',
+                    type=str,
+                    default=os.environ.get('GRASPIT_PLUGIN_DIR', ''),
+                    help="Path to directory with a graspit_interface plugin")
+
+
+class GraspValidator:
+    """ Stored grasps replay
+
+    Every grasp is executed from its stored hand state with the current
+    hand model and quality measure, grasps which fail are dropped.
+
+    """
+
+    def __init__(self, graspit_process, reader, robot='ManoHand'):
+        """Constructor
+
+        Arguments:
+            graspit_process {GraspitProcess} -- process
+            reader {GraspWriter} -- stored grasps reader, GraspWriter or GraspStore
+
+        Keyword Arguments:
+            robot {str} -- hand model (default: {'ManoHand'})
+        """
+        self._process = graspit_process
+        self._reader = reader
+        self._robot = robot
+        self._stats = {}
+
+    @property
+    def stats(self):
+        """ Statistics of the last processed object """
+        return self._stats
+
+    def __call__(self, object_name):
+        """Replay stored grasps of an object
+
+        Arguments:
+            object_name {str} -- object
+
+        Returns:
+            tuple -- object_name, grasps which still succeed sorted by quality
+        """
+        if not self._process.run:
+            self._process.start()
+
+        stored = self._reader.read(object_name)
+        scene = GraspitScene(self._process.graspit, self._robot, object_name,
+                             robots_dir=self._process.robots_dir)
+        jobs = [(g['pose'], g['dofs'], dict(approach=False, auto_open=False)) for g in stored]
+        states = [s for s in scene.graspBatch(jobs, object_name, compact=True) if s is not None]
+        arrays = arrays_from_states(states)
+        arrays = select_grasps(arrays, np.argsort(-arrays['quality'], kind='mergesort'))
+        grasps = grasps_from_states(object_name, arrays, scene.kinematics)
+        self._stats = dict(checked=len(stored), dropped=len(stored) - len(grasps))
+        return (object_name, grasps)
+
+
+def main(args):
+    reader = open_reader(args.path_in)
+    models = args.models or reader.names
+    models = [name for name in models if reader.exists(name)]
+
+    if args.format == 'store':
+        writer = GraspStoreWriter(args.path_out)
+    else:
+        if not os.path.isdir(args.path_out):
+            os.makedirs(args.path_out)
+        writer = GraspWriter(args.path_out)
+    catalog = GraspCatalog(args.path_out) if args.catalog else None
+
+    process_args = dict(graspit_dir=args.graspit_dir,
+                        plugin_dir=args.plugin_dir,
+                        headless=True,
+                        xvfb_run=args.xvfb,
+                        verbose=args.verbose)
+    totals = dict(objects=0, checked=0, dropped=0)
+
+    def save(body_name, body_grasps, stats):
+        print('{}: {checked} checked, {dropped} dropped, {elapsed:.1f} s'.format(
+            body_name, **stats))
+        ranges = writer.write(body_name, body_grasps)
+        if catalog is not None:
+            catalog.add(body_name, body_grasps, ranges)
+        totals['objects'] += 1
+        totals['checked'] += stats['checked']
+        totals['dropped'] += stats['dropped']
+
+    started = time.time()
+    if args.n_jobs > 1:
+        task_factory = partial(GraspValidator, reader=reader, robot=args.robot)
+        with GraspitPool(task_factory, args.n_jobs, **process_args) as pool:
+            for (body_name, body_grasps), stats in pool.imap(models):
+                save(body_name, body_grasps, stats)
+    else:
+        with GraspitProcess(**process_args) as process:
+            validator = GraspValidator(process, reader, args.robot)
+            for body in models:
+                object_started = time.time()
+                body_name, body_grasps = validator(body)
+                save(body_name, body_grasps,
+                     dict(validator.stats, elapsed=time.time() - object_started))
+    elapsed = time.time() - started
+
+    print('{objects} objects, {checked} grasps checked, {dropped} dropped'.format(**totals))
+    print('Throughput: {:.1f} grasps/s, {:.2f} objects/s'.format(totals['checked'] / elapsed,
+                                                                 totals['objects'] / elapsed))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,173 @@
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# rough size of a vertex with its share of faces in a text mesh file, bytes
+BYTES_PER_VERTEX = 64
+
+
+def mesh_vertices(filename):
+    """Number of mesh vertices
+
+    The count is read from PLY and OFF headers and OBJ vertex lines, for
+    other formats it is approximated by the file size.
+
+    Arguments:
+        filename {str} -- mesh file
+
+    Returns:
+        int -- number of vertices or None if the file is missing
+    """
+    if not os.path.isfile(filename):
+        return None
+    ext = os.path.splitext(filename)[1].lower()
+    try:
+        if ext == '.ply':
+            with open(filename, 'rb') as f:
+                for line in f:
+                    fields = line.split()
+                    if fields[:2] == [b'element', b'vertex']:
+                        return int(fields[2])
+                    if fields[:1] == [b'end_header']:
+                        break
+        elif ext == '.off':
+            with open(filename, 'rb') as f:
+                fields = f.readline().split()[1:] or f.readline().split()
+                return int(fields[0])
+        elif ext == '.obj':
+            with open(filename, 'rb') as f:
+                return sum(1 for line in f if line.startswith(b'v '))
+    except (IOError, ValueError, IndexError):
+        pass
+    return os.path.getsize(filename) // BYTES_PER_VERTEX
+
+
+def object_files(objects_dir, name):
+    """Files of a GraspIt graspable body
+
+    Arguments:
+        objects_dir {str} -- GraspIt graspable bodies directory
+        name {str} -- object name
+
+    Returns:
+        list -- existing body XML and mesh files
+    """
+    filename = os.path.join(objects_dir, '{}.xml'.format(name))
+    if not os.path.isfile(filename):
+        return []
+    try:
+        geometry = ET.parse(filename).getroot().find('geometryFile')
+    except ET.ParseError:
+        return [filename]
+    if geometry is None or not geometry.text:
+        return [filename]
+    mesh = os.path.join(objects_dir, geometry.text.strip())
+    return [filename, mesh] if os.path.isfile(mesh) else [filename]
+
+
+class Scheduler:
+    """ Longest-expected-first ordering of objects
+
+    The cost of an object is its duration recorded in previous runs. For
+    objects without a record the cost is estimated from the number of
+    vertices of the object mesh, scaled by the median duration per vertex
+    of recorded objects. Durations are appended to a JSON lines file, so
+    later runs get better estimates.
+
+    """
+
+    def __init__(self, objects_dir='', timings_path=''):
+        """Constructor
+
+        Keyword Arguments:
+            objects_dir {str} -- GraspIt graspable bodies directory (default: {''})
+            timings_path {str} -- per-object durations file (default: {''})
+        """
+        self._objects_dir = objects_dir
+        self._timings_path = timings_path
+        self._timings = {}
+        if timings_path and os.path.isfile(timings_path):
+            with open(timings_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of an interrupted run
+                    self._timings[record['name']] = record['elapsed']
+
+    @property
+    def timings(self):
+        """ Recorded durations per object, seconds """
+        return self._timings
+
+    def vertices(self, name):
+        """Number of vertices of the object mesh
+
+        Arguments:
+            name {str} -- object name
+
+        Returns:
+            int -- number of vertices or None if the object is not found
+        """
+        files = object_files(self._objects_dir, name)
+        if len(files) < 2:
+            return None
+        return mesh_vertices(files[1])
+
+    def estimate(self, names):
+        """Expected durations of objects
+
+        Arguments:
+            names {list} -- object names
+
+        Returns:
+            dict -- object name -> expected duration, relative units if
+                there are no recorded durations
+        """
+        vertices = dict((name, self.vertices(name)) for name in names)
+        rates = [
+            self._timings[name] / vertices[name]
+            for name in names
+            if name in self._timings and vertices[name]
+        ]
+        rate = np.median(rates) if rates else 1.0
+        default = np.median(list(self._timings.values())) if self._timings else 0.0
+
+        costs = {}
+        for name in names:
+            if name in self._timings:
+                costs[name] = self._timings[name]
+            elif vertices[name] is not None and (rates or not self._timings):
+                costs[name] = vertices[name] * rate
+            else:
+                costs[name] = default
+        return costs
+
+    def order(self, names):
+        """Order objects longest expected first, ties keep the original order
+
+        Arguments:
+            names {list} -- object names
+
+        Returns:
+            list -- ordered object names
+        """
+        costs = self.estimate(names)
+        return sorted(names, key=lambda name: -costs[name])
+
+    def record(self, name, elapsed):
+        """Record the actual duration of an object
+
+        Arguments:
+            name {str} -- object name
+            elapsed {float} -- duration, seconds
+        """
+        self._timings[name] = elapsed
+        if self._timings_path:
+            with open(self._timings_path, 'a') as f:
+                f.write(json.dumps(dict(name=name, elapsed=elapsed)) + '\n')
+
+    def __repr__(self):
+        return "Scheduler: {} recorded objects".format(len(self._timings))
@@ -0,0 +1,154 @@
+import math
+from functools import partial
+
+from graspit_pool import GraspitPool
+from graspit_process import GraspitProcess
+from graspit_scene import SceneManager
+from profiler import Profiler
+
+
+class _Chunk:
+    """ Slice of a scene grasp jobs """
+
+    def __init__(self, robot, body, start, jobs, compact=False):
+        self.robot = robot
+        self.body = body
+        self.start = start
+        self.jobs = jobs
+        self.compact = compact
+
+    def __repr__(self):
+        return "{}/{}[{}:{}]".format(self.robot, self.body, self.start,
+                                     self.start + len(self.jobs))
+
+
+class _ShardTask:
+    """ Executes job chunks on the scene of its own GraspIt instance """
+
+    def __init__(self, graspit_process, profile=False):
+        # records are popped by the pool worker after every chunk
+        self._profiler = Profiler(enabled=profile)
+        self._scenes = SceneManager(graspit_process.graspit,
+                                    profiler=self._profiler,
+                                    robots_dir=graspit_process.robots_dir)
+        self._stats = {}
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    def __call__(self, chunk):
+        loads = self._scenes.loads
+        scene = self._scenes.scene(chunk.robot, chunk.body)
+        round_trips = scene.round_trips
+        round_trips_saved = scene.round_trips_saved
+        grasps = scene.graspBatch(chunk.jobs, chunk.body, chunk.compact)
+        self._stats = dict(round_trips=scene.round_trips - round_trips,
+                           round_trips_saved=scene.round_trips_saved - round_trips_saved,
+                           scene_loads=self._scenes.loads - loads)
+        return chunk.start, grasps
+
+
+class ShardExecutor:
+    """ Grasp jobs execution across several GraspIt instances
+
+    Jobs of a single scene are split into chunks which are executed by a
+    pool of GraspIt instances with the same robot and body loaded. An
+    instance keeps its scene between chunks, so the scene is loaded once
+    per instance.
+
+    """
+
+    def __init__(self,
+                 n_shards=2,
+                 chunk_size=0,
+                 process_class=GraspitProcess,
+                 profiler=None,
+                 **process_args):
+        """Constructor
+
+        Keyword Arguments:
+            n_shards {int} -- number of GraspIt instances (default: {2})
+            chunk_size {int} -- jobs per chunk (default: {auto})
+            process_class {type} -- GraspIt process wrapper (default: {GraspitProcess})
+            profiler {Profiler} -- record GraspIt calls of the instances (default: {None})
+            process_args -- GraspitProcess constructor arguments
+        """
+        self._n_shards = n_shards
+        self._chunk_size = chunk_size
+        self._profiler = profiler or Profiler(enabled=False)
+        # instances record into profilers of their own, a forked copy would repeat the records
+        task_factory = partial(_ShardTask, profile=self._profiler.enabled)
+        self._pool = GraspitPool(task_factory, n_shards, process_class, **process_args)
+        self._stats = {}
+        self._run = False
+
+    @property
+    def n_shards(self):
+        """ Number of GraspIt instances """
+        return self._n_shards
+
+    @property
+    def run(self):
+        return self._run
+
+    @property
+    def stats(self):
+        """ Statistics of the last execution """
+        return self._stats
+
+    def start(self, wait=True):
+        """Start the GraspIt instances, see GraspitPool.start"""
+        assert self._run == False
+        self._pool.start(wait)
+        self._run = True
+
+    def execute(self, robot, body, jobs, compact=False):
+        """Execute grasp jobs on the scene
+
+        Arguments:
+            robot {str} -- robot name
+            body {str} -- graspable body name
+            jobs {list} -- (pose, dofs, variant) tuples, see GraspitScene.graspBatch
+
+        Keyword Arguments:
+            compact {bool} -- return GraspState grasps (default: {False})
+
+        Returns:
+            list -- grasp or None per job, in jobs order
+        """
+        if not self._run:
+            self.start()
+        # a few chunks per instance balance the load
+        chunk_size = self._chunk_size or int(math.ceil(len(jobs) / (4.0 * self._n_shards)))
+        chunks = (_Chunk(robot, body, i, jobs[i:i + chunk_size], compact)
+                  for i in range(0, len(jobs), max(chunk_size, 1)))
+
+        grasps = [None] * len(jobs)
+        self._stats = dict(round_trips=0, round_trips_saved=0, scene_loads=0, chunks=0)
+        for (start, chunk_grasps), task_stats in self._pool.imap(chunks):
+            grasps[start:start + len(chunk_grasps)] = chunk_grasps
+            self._stats['chunks'] += 1
+            for name in ['round_trips', 'round_trips_saved', 'scene_loads']:
+                self._stats[name] += task_stats[name]
+            self._profiler.merge(task_stats.get('profile', []))
+        return grasps
+
+    def join(self):
+        if self._run:
+            self._pool.join()
+        self._run = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.join()
+
+    def __repr__(self):
+        return "Shard executor: {} GraspIt instances".format(self._n_shards)
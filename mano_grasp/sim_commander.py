@@ -0,0 +1,243 @@
+import os
+import time
+
+import numpy as np
+
+from kinematics import CHAIN_NAME
+
+# typical GraspIt call latencies, seconds, planGrasps latency is per planner step
+DEFAULT_LATENCY = dict(
+    clearWorld=0.01,
+    importRobot=0.3,
+    importGraspableBody=0.2,
+    planGrasps=5e-4,
+    toggleAllCollisions=1e-3,
+    setRobotPose=1e-3,
+    forceRobotDof=1e-3,
+    autoOpen=0.01,
+    approachToContact=0.01,
+    autoGrasp=0.02,
+    computeQuality=5e-3,
+    getRobot=3e-3,
+)
+
+DEFAULT_ROBOTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')
+
+
+class Message(object):
+    """ Generic response message """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class Point(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = x, y, z
+
+
+class Quaternion(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, w=0.0):
+        self.x, self.y, self.z, self.w = x, y, z, w
+
+
+class Pose(object):
+    """ Stand-in for geometry_msgs/Pose """
+
+    def __init__(self, position=None, orientation=None):
+        self.position = position or Point()
+        self.orientation = orientation or Quaternion()
+
+
+def _pose(values):
+    x, y, z, qx, qy, qz, qw = values
+    return Pose(Point(x, y, z), Quaternion(qx, qy, qz, qw))
+
+
+class SimulatedCommander:
+    """ Simulated GraspitCommander
+
+    Mimics GraspIt responses with random but plausible plans, robot states
+    and grasp qualities. Every call sleeps for its typical latency scaled
+    by latency_scale.
+
+    """
+
+    def __init__(self,
+                 latency=None,
+                 latency_scale=1.0,
+                 failure_rate=0.3,
+                 error_rate=0.0,
+                 n_plans=20,
+                 n_dofs=16,
+                 seed=0):
+        """Constructor
+
+        Keyword Arguments:
+            latency {dict} -- call latencies, seconds (default: {DEFAULT_LATENCY})
+            latency_scale {float} -- latency multiplier, 0 disables sleeping (default: {1.0})
+            failure_rate {float} -- fraction of grasps with a failed quality (default: {0.3})
+            error_rate {float} -- fraction of calls raising an exception (default: {0.0})
+            n_plans {int} -- number of plans returned by planGrasps (default: {20})
+            n_dofs {int} -- number of hand dofs (default: {16})
+            seed {int} -- random seed (default: {0})
+        """
+        self._latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self._latency_scale = latency_scale
+        self._failure_rate = failure_rate
+        self._error_rate = error_rate
+        self._n_plans = n_plans
+        self._n_dofs = n_dofs
+        self._rs = np.random.RandomState(seed)
+        self._body = ''
+        self._pose = [0, 0, 0, 0, 0, 0, 1]
+        self._dofs = np.zeros(n_dofs)
+        self._contacts = []
+        self.calls = 0
+
+    def _call(self, name, latency=None):
+        self.calls += 1
+        if latency is None:
+            latency = self._latency.get(name, 0.0)
+        if self._latency_scale > 0:
+            time.sleep(latency * self._latency_scale)
+        if self._error_rate > 0 and self._rs.uniform() < self._error_rate:
+            raise Exception('Simulated {} failure'.format(name))
+        return Message(result=0)
+
+    def _randomPose(self):
+        position = self._rs.normal(size=3)
+        position *= 0.1 / np.linalg.norm(position)
+        orientation = self._rs.normal(size=4)
+        orientation /= np.linalg.norm(orientation)
+        return position.tolist() + orientation.tolist()
+
+    def clearWorld(self):
+        self._body = ''
+        return self._call('clearWorld')
+
+    def importRobot(self, robot_name):
+        return self._call('importRobot')
+
+    def importGraspableBody(self, body_name):
+        self._body = body_name
+        return self._call('importGraspableBody')
+
+    def planGrasps(self, max_steps=70000, **_):
+        response = self._call('planGrasps', self._latency['planGrasps'] * (max_steps or 70000))
+        response.grasps = [
+            Message(pose=_pose(self._randomPose()),
+                    dofs=tuple(self._rs.uniform(0.0, 1.5, self._n_dofs)),
+                    epsilon_quality=self._rs.uniform(0.0, 0.3),
+                    volume_quality=self._rs.uniform(0.0, 0.1)) for _ in range(self._n_plans)
+        ]
+        return response
+
+    def toggleAllCollisions(self, enable):
+        return self._call('toggleAllCollisions')
+
+    def setRobotPose(self, pose):
+        p, o = pose.position, pose.orientation
+        self._pose = [p.x, p.y, p.z, o.x, o.y, o.z, o.w]
+        return self._call('setRobotPose')
+
+    def forceRobotDof(self, dofs):
+        self._dofs = np.array(dofs, dtype=np.float64)
+        return self._call('forceRobotDof')
+
+    def autoOpen(self):
+        self._dofs = np.zeros(self._n_dofs)
+        return self._call('autoOpen')
+
+    def approachToContact(self):
+        return self._call('approachToContact')
+
+    def autoGrasp(self):
+        self._dofs = np.minimum(self._dofs + self._rs.uniform(0.0, 0.5, self._n_dofs), 1.6)
+        links = ['Base'] + ['Hand_{}_link{}'.format(c, l) for c in CHAIN_NAME for l in range(3)]
+        chosen = self._rs.choice(len(links), self._rs.randint(0, 7), replace=False)
+        self._contacts = [
+            Message(body1=links[i], body2=self._body, ps=Message(pose=_pose(self._randomPose())))
+            for i in chosen
+        ]
+        return self._call('autoGrasp')
+
+    def computeQuality(self):
+        response = self._call('computeQuality')
+        if self._rs.uniform() < self._failure_rate:
+            response.result = 1
+        response.epsilon = self._rs.uniform(0.0, 0.3) if self._contacts else -1.0
+        response.volume = self._rs.uniform(0.0, 0.1) if self._contacts else 0.0
+        return response
+
+    def getRobot(self, id=0):
+        response = self._call('getRobot')
+        response.robot = Message(pose=_pose(self._pose),
+                                 dofs=tuple(self._dofs),
+                                 contacts=list(self._contacts))
+        return response
+
+    def __repr__(self):
+        return "Simulated GraspIt commander"
+
+
+class SimulatedProcess:
+    """ GraspitProcess counterpart driving a SimulatedCommander """
+
+    def __init__(self, robots_dir=DEFAULT_ROBOTS_DIR, startup=0.0, **commander_args):
+        """Constructor
+
+        Keyword Arguments:
+            robots_dir {str} -- path to directory with robot models (default: {repository models})
+            startup {float} -- simulated startup time, seconds (default: {0.0})
+            commander_args -- SimulatedCommander constructor arguments
+        """
+        self._robots_dir = robots_dir
+        self._startup = startup
+        self._commander_args = commander_args
+        self._commander = None
+        self._startup_time = None
+        self._run = False
+
+    @property
+    def graspit(self):
+        return self._commander
+
+    @property
+    def startup_time(self):
+        return self._startup_time
+
+    @property
+    def start_attempts(self):
+        return 1 if self._run else 0
+
+    @property
+    def robots_dir(self):
+        return self._robots_dir
+
+    @property
+    def run(self):
+        return self._run
+
+    def start(self):
+        assert self._run == False
+        started = time.time()
+        time.sleep(self._startup)
+        self._commander = SimulatedCommander(**self._commander_args)
+        self._startup_time = time.time() - started
+        self._run = True
+
+    def join(self, timeout=5.0):
+        self._run = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.join()
+
+    def __repr__(self):
+        return "Simulated GraspIt process"
@@ -0,0 +1,138 @@
+import os
+import select
+import subprocess
+import time
+
+
+class XvfbServer:
+    """ Xserver Virtual Frame Buffer shared by GraspIt instances
+
+    A single X server is started on a free display and GraspIt instances
+    are pointed at it through DISPLAY, instead of an xvfb-run wrapper
+    with its own X server per instance.
+
+    """
+
+    def __init__(self, display=0, screen='640x480x24', timeout=10.0):
+        """Constructor
+
+        Keyword Arguments:
+            display {int} -- display number, 0 lets the server pick a free one (default: {0})
+            screen {str} -- screen geometry and depth (default: {'640x480x24'})
+            timeout {float} -- max server startup time, seconds (default: {10.0})
+        """
+        self._number = display
+        self._screen = screen
+        self._timeout = timeout
+        self._proc = None
+        self._startup_time = None
+
+    @property
+    def display(self):
+        """ DISPLAY value of the server """
+        return ':{}'.format(self._number)
+
+    @property
+    def startup_time(self):
+        """ Time to start the server, seconds """
+        return self._startup_time
+
+    @property
+    def run(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        assert self._proc is None
+        started = time.time()
+        devnull = open(os.devnull, 'wb')
+        if self._number:
+            display_args, read_fd, write_fd = [self.display], None, None
+        else:
+            # the server picks a free display itself and reports it once it is ready,
+            # probing lock files would race with concurrent runs
+            read_fd, write_fd = os.pipe()
+            if hasattr(os, 'set_inheritable'):
+                os.set_inheritable(write_fd, True)
+            display_args = ['-displayfd', str(write_fd)]
+        try:
+            self._proc = subprocess.Popen(
+                ['Xvfb'] + display_args + ['-screen', '0', self._screen, '-nolisten', 'tcp'],
+                shell=False,
+                stdout=devnull,
+                stderr=devnull,
+                close_fds=False)
+        finally:
+            if write_fd is not None:
+                os.close(write_fd)
+        try:
+            if read_fd is not None:
+                self._number = self._readDisplay(read_fd, started)
+            unix_socket = '/tmp/.X11-unix/X{}'.format(self._number)
+            while not os.path.exists(unix_socket):
+                self._checkStartup(started)
+                time.sleep(0.01)
+        finally:
+            if read_fd is not None:
+                os.close(read_fd)
+        self._startup_time = time.time() - started
+
+    def _readDisplay(self, read_fd, started):
+        """Display number written by the server to -displayfd"""
+        output = b''
+        while not output.endswith(b'\n'):
+            self._checkStartup(started)
+            if select.select([read_fd], [], [], 0.01)[0]:
+                data = os.read(read_fd, 16)
+                if not data:
+                    self._checkStartup(started, closed=True)
+                output += data
+        return int(output)
+
+    def _checkStartup(self, started, closed=False):
+        if closed or self._proc.poll() is not None or time.time() - started > self._timeout:
+            retcode = self._proc.poll()
+            self.join()
+            raise Exception('Cannot start Xvfb on {}, retcode: {}'.format(
+                self.display if self._number else 'a free display', retcode))
+
+    def rss(self):
+        """Resident memory of the server
+
+        Returns:
+            int -- resident set size, bytes, or None if unknown
+        """
+        if not self.run:
+            return None
+        try:
+            with open('/proc/{}/status'.format(self._proc.pid)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except IOError:
+            pass
+        return None
+
+    def join(self, timeout=5.0):
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.terminate()
+            deadline = time.time() + timeout
+            while self._proc.poll() is None and time.time() < deadline:
+                time.sleep(0.01)
+            if self._proc.poll() is None:
+                self._proc.kill()
+                self._proc.wait()
+            self._proc = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.join()
+
+    def __del__(self):
+        self.join()
+
+    def __repr__(self):
+        return "Xvfb server: {}".format(self.display)
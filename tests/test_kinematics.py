@@ -0,0 +1,47 @@
+import os
+import unittest
+
+import numpy as np
+
+from mano_grasp.kinematics import Kinematics
+
+ROBOT_DIR = os.path.join(os.path.dirname(__file__), '..', 'models', 'ManoHand')
+
+
+class TestManoPoses(unittest.TestCase):
+    """ Batch GraspIt -> MANO conversion against the scalar one """
+
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+        self.kinematics = Kinematics(ROBOT_DIR)
+
+    def random_grasps(self, n):
+        """ Random root positions, unit quaternions x,y,z,w and joint angles """
+        xyz = self.rs.uniform(-0.2, 0.2, size=(n, 3))
+        quat = self.rs.normal(size=(n, 4))
+        quat /= np.linalg.norm(quat, axis=1)[:, None]
+        quat[0] = [0, 0, 0, 1]
+        dofs = self.rs.uniform(-0.2, 1.5, size=(n, 20))
+        dofs[0] = 0
+        return xyz, quat, dofs
+
+    def test_get_mano_poses(self):
+        xyz, quat, dofs = self.random_grasps(200)
+        trans, pose = self.kinematics.getManoPoses(xyz, quat, dofs)
+        self.assertEqual(trans.shape, (200, 3))
+        self.assertEqual(pose.shape, (200, 48))
+        for i in range(len(xyz)):
+            scalar_trans, scalar_pose = self.kinematics.getManoPose(xyz[i], quat[i], dofs[i])
+            np.testing.assert_allclose(trans[i], np.reshape(scalar_trans, 3), rtol=0, atol=1e-9)
+            np.testing.assert_allclose(pose[i], scalar_pose, rtol=0, atol=1e-9)
+
+    def test_single_grasp(self):
+        xyz, quat, dofs = self.random_grasps(2)
+        trans, pose = self.kinematics.getManoPoses(xyz[1], quat[1], dofs[1])
+        scalar_trans, scalar_pose = self.kinematics.getManoPose(xyz[1], quat[1], dofs[1])
+        np.testing.assert_allclose(trans, np.reshape(scalar_trans, (1, 3)), rtol=0, atol=1e-9)
+        np.testing.assert_allclose(pose, [scalar_pose], rtol=0, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import numpy as np
+
+from mano_grasp.math_utils import *
+
+
+def random_rvecs(rs, n):
+    """ Random rotations with angles up to pi, plus identity and near half turns """
+    axes = rs.normal(size=(n, 3))
+    axes /= np.linalg.norm(axes, axis=1)[:, None]
+    angles = rs.uniform(0, np.pi, size=n)
+    angles[:4] = [np.pi, np.pi - 1e-9, np.pi - 1e-5, np.pi - 1e-3]
+    rvecs = axes * angles[:, None]
+    rvecs[4] = 0
+    rvecs[5:8] = np.eye(3) * np.pi  # half turns about the coordinate axes
+    return rvecs
+
+
+class TestRotations(unittest.TestCase):
+    """ Batch rotations against the scalar transforms3d based functions """
+
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+
+    def test_mats_rotate(self):
+        angles = self.rs.uniform(-2 * np.pi, 2 * np.pi, size=200)
+        angles[:3] = [0, np.pi, -np.pi]
+        for scalar, batch in [(mat_rotate_x, mats_rotate_x), (mat_rotate_y, mats_rotate_y),
+                              (mat_rotate_z, mats_rotate_z)]:
+            expected = np.array([np.asarray(scalar(a)) for a in angles])
+            np.testing.assert_allclose(batch(angles), expected, atol=1e-12)
+            self.assertEqual(batch(angles.reshape(20, 10)).shape, (20, 10, 3, 3))
+
+    def test_mats_rotate_axis(self):
+        # a rotation about x keeps x and is a proper rotation
+        mats = mats_rotate_x(self.rs.uniform(-np.pi, np.pi, size=50))
+        np.testing.assert_allclose(mats[:, :, 0], np.tile([1, 0, 0], (50, 1)), atol=1e-12)
+        np.testing.assert_allclose(np.linalg.det(mats), 1, atol=1e-12)
+
+    def test_quats_from_mats(self):
+        mats = np.array([np.asarray(mat_from_rvec(r)) for r in random_rvecs(self.rs, 500)])
+        quats = quats_from_mats(mats)
+        expected = np.array([quat_from_mat(m) for m in mats])
+        # q and -q are the same rotation, both functions return w >= 0,
+        # which leaves the sign undefined for half turns only
+        sign = np.where(np.sum(quats * expected, axis=1) < 0, -1.0, 1.0)
+        np.testing.assert_allclose(quats * sign[:, None], expected, atol=1e-7)
+        self.assertTrue(np.all(quats[:, 3] >= 0))
+        np.testing.assert_allclose(np.linalg.norm(quats, axis=1), 1, atol=1e-12)
+        # the quaternion gives back the rotation, whatever its sign
+        np.testing.assert_allclose(mats_from_quats(quats), mats, atol=1e-7)
+
+    def test_quats_from_mats_half_turns(self):
+        mats = mats_from_rvecs(np.eye(3) * np.pi)
+        quats = quats_from_mats(mats)
+        np.testing.assert_allclose(np.abs(quats), np.hstack([np.eye(3), np.zeros((3, 1))]),
+                                   atol=1e-12)
+
+    def test_quats_from_mats_shape(self):
+        mats = mats_from_rvecs(random_rvecs(self.rs, 24)).reshape(4, 6, 3, 3)
+        self.assertEqual(quats_from_mats(mats).shape, (4, 6, 4))
+
+    def test_mats_from_quats(self):
+        quats = self.rs.normal(size=(200, 4))
+        quats /= np.linalg.norm(quats, axis=1)[:, None]
+        expected = np.array([np.asarray(mat_from_quat(q)) for q in quats])
+        np.testing.assert_allclose(mats_from_quats(quats), expected, atol=1e-12)
+        np.testing.assert_allclose(mats_from_quats(-quats), expected, atol=1e-12)
+
+    def test_rvecs(self):
+        rvecs = random_rvecs(self.rs, 200)
+        expected = np.array([np.asarray(mat_from_rvec(r)) for r in rvecs])
+        mats = mats_from_rvecs(rvecs)
+        np.testing.assert_allclose(mats, expected, atol=1e-12)
+        # the axis of a half turn is defined up to its sign
+        result = mats_from_rvecs(rvecs_from_mats(mats))
+        np.testing.assert_allclose(result, mats, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import os
+import unittest
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from mano_grasp.kinematics import CHAIN_NAME
+from mano_grasp.math_utils import *
+from mano_grasp.plan_filter import HandPoints, load_mesh
+
+ROBOT_DIR = os.path.join(os.path.dirname(__file__), '..', 'models', 'ManoHand')
+
+
+def dh(theta, d, a, alpha):
+    """ Denavit-Hartenberg transform, rotz(theta) transz(d) transx(a) rotx(alpha) """
+    m = np.eye(4)
+    m[:3, :3] = np.dot(mat_rotate_z(theta), mat_rotate_x(alpha))
+    m[:3, 3] = [a * np.cos(theta), a * np.sin(theta), d]
+    return m
+
+
+def link_vertices(link):
+    """ Mesh vertices of a ManoHand link in its own frame, millimeters """
+    root = ET.parse(os.path.join(ROBOT_DIR, 'iv', '{}.xml'.format(link))).getroot()
+    vertices, _ = load_mesh(os.path.join(ROBOT_DIR, 'iv', root.find('geometryFile').text))
+    return vertices
+
+
+def min_distance(a, b):
+    return np.sqrt(np.min(np.sum((a[:, None] - b[None]) ** 2, axis=-1)))
+
+
+class TestHandPoints(unittest.TestCase):
+    """ HandPoints forward kinematics of the robot XML against kinematics.json
+
+    kinematics.json holds the chain base rotations and DH parameters in
+    meters used by the GraspIt -> MANO conversion. It has no chain base
+    translations, so fingertips are compared by their displacement
+    between hand configurations.
+
+    """
+
+    def setUp(self):
+        with open(os.path.join(ROBOT_DIR, 'kinematics.json')) as f:
+            self.data = json.load(f)
+        self.hand = HandPoints(ROBOT_DIR)
+        self.rs = np.random.RandomState(0)
+        self.tips = [
+            np.append(link_vertices('{}3'.format(name)).mean(axis=0) * 0.001, 1)
+            for name in CHAIN_NAME.values()
+        ]
+
+    def randomDofs(self, n):
+        dofs = np.zeros((n, 20))
+        for name in CHAIN_NAME.values():
+            for i in range(4):
+                low, high = self.data['{}_{}_limits'.format(name, i)]
+                index = self.data['{}_{}_dof_index'.format(name, i)]
+                dofs[:, index] = self.rs.uniform(low, high, size=n)
+        return dofs
+
+    def tip(self, chain, dofs):
+        """ Fingertip in the hand frame, up to the chain base translation """
+        m = np.eye(4)
+        m[:3, :3] = self.data['{}_graspit_origin'.format(chain)]
+        for i in range(4):
+            d, theta0, a, alpha = self.data['{}_{}_dh'.format(chain, i)]
+            theta = dofs[self.data['{}_{}_dof_index'.format(chain, i)]] * \
+                self.data['{}_{}_dof_coeff'.format(chain, i)]
+            m = m.dot(dh(theta + theta0, d, a, alpha))
+        return m
+
+    def test_link_meshes_are_connected(self):
+        # the hand mesh is cut into links, so in the rest pose every link
+        # shares its boundary vertices with the parent link
+        frames = self.hand.frames(np.zeros((1, 20)))
+        for name, chain_frames in zip(CHAIN_NAME.values(), frames):
+            parent = link_vertices('palm')
+            # the first link follows a universal joint of two dofs
+            for i, m in enumerate([chain_frames[1][0], chain_frames[2][0], chain_frames[3][0]]):
+                vertices = link_vertices('{}{}'.format(name, i + 1)).dot(m[:3, :3].T) + m[:3, 3]
+                self.assertLess(min_distance(vertices, parent), 0.01, '{}{}'.format(name, i + 1))
+                parent = vertices
+
+    def test_fingertips(self):
+        dofs = self.randomDofs(50)
+        pose = [0, 0, 0, 0, 0, 0, 1]
+        points = self.hand(np.tile(pose, (len(dofs), 1)), dofs)
+        self.assertEqual(points.shape, (50, 6, 3))
+        for c, chain in enumerate(CHAIN_NAME.values()):
+            expected = np.array([self.tip(chain, q).dot(self.tips[c])[:3] for q in dofs])
+            # displacements cancel out the chain base translation
+            np.testing.assert_allclose(points[1:, c + 1] - points[0, c + 1],
+                                       expected[1:] - expected[0],
+                                       atol=1e-6)
+
+    def test_palm_is_fixed(self):
+        dofs = self.randomDofs(10)
+        points = self.hand(np.tile([0, 0, 0, 0, 0, 0, 1], (len(dofs), 1)), dofs)
+        np.testing.assert_allclose(points[:, 0], np.tile(points[0, 0], (len(dofs), 1)))
+
+    def test_hand_pose(self):
+        dofs = self.randomDofs(20)
+        quats = self.rs.normal(size=(20, 4))
+        quats /= np.linalg.norm(quats, axis=1)[:, None]
+        positions = self.rs.uniform(-0.5, 0.5, size=(20, 3))
+        local = self.hand(np.tile([0, 0, 0, 0, 0, 0, 1], (len(dofs), 1)), dofs)
+        points = self.hand(np.hstack([positions, quats]), dofs)
+        for i in range(len(dofs)):
+            rotation = np.asarray(mat_from_quat(quats[i]))
+            np.testing.assert_allclose(points[i], local[i].dot(rotation.T) + positions[i],
+                                       atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()